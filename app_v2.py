@@ -2,15 +2,21 @@ import streamlit as st
 import pandas as pd
 import numpy as np
 from scipy.optimize import linprog
-import plotly.express as px
-import plotly.graph_objects as go
 from geopy.distance import geodesic
 from geopy.geocoders import Nominatim
 import json
+import importlib.util
+import zipfile
 from io import BytesIO
 import time
+import threading
 import db  # SQLite数据库模块
 
+try:
+    import orjson  # optional: C JSON encoder for the config export (可选依赖)
+except ImportError:
+    orjson = None
+
 # Page configuration
 st.set_page_config(
     page_title="Smart Warehouse Allocation System", 
@@ -21,110 +27,515 @@ st.set_page_config(
 
 # Initialize session state from SQLite database
 if 'db_initialized' not in st.session_state:
-    data = db.load_all_data()
-    
-    st.session_state.warehouses = data['warehouses'].copy()
-    st.session_state.distribution_centers = data['distribution_centers'].copy()
-    st.session_state.demand_forecast = data['demand_forecast'].copy()
-    st.session_state.customer_allocation_plan = data['customer_allocation_plan'].copy()
-    st.session_state.carriers = data['carriers'].copy()
-    st.session_state.rates = data['rates'].copy()
-    st.session_state.sku = data['sku'].copy()
-    st.session_state.warehouse_inventory = data['warehouse_inventory'].copy()
-    st.session_state.vehicles = data['vehicles'].copy()
-    st.session_state.market_shipping_rate = data['market_shipping_rate']
-    st.session_state.tms_shipping_rate = data['tms_shipping_rate']
+    db.reload_session_state()
     st.session_state.customer_selected_warehouses = st.session_state.warehouses['Name'].tolist()
     st.session_state.db_initialized = True
 
 
+NOMINATIM_MIN_INTERVAL = 1.1  # seconds between requests
+RATE_TABLE_PAGE_SIZE = 500  # rows of the rate table sent to the browser per render
+TABLE_WIDTH = 1200  # fixed pixel width for the large generated tables (no per-render width fitting)
+
+
+@st.cache_resource
+def _nominatim_client():
+    """Process-wide geocoder + throttle state, shared across reruns and sessions"""
+    return {
+        'geolocator': Nominatim(user_agent="smart_warehouse_optimizer_app_v2_cloud"),
+        'lock': threading.Lock(),
+        'last_call': 0.0
+    }
+
+
+def _geocode_uncached(address):
+    """Hit Nominatim for one address (中文: 实际发起网络请求)"""
+    client = _nominatim_client()
+    # Respect Nominatim usage policy (max 1 request/sec) to avoid 429 errors.
+    # Only real network calls wait, and only for what is left of the interval.
+    with client['lock']:
+        wait = NOMINATIM_MIN_INTERVAL - (time.monotonic() - client['last_call'])
+        if wait > 0:
+            time.sleep(wait)
+        try:
+            location = client['geolocator'].geocode(address)
+        finally:
+            client['last_call'] = time.monotonic()
+
+    if location:
+        return location.latitude, location.longitude
+    return None, None
+
+
 @st.cache_data
 def geocode_address(address):
     """Convert address to coordinates (中文: 将地址转换为坐标)"""
-    # Respect Nominatim usage policy (max 1 request/sec) to avoid 429 errors
-    time.sleep(1.1)
     try:
-        geolocator = Nominatim(user_agent="smart_warehouse_optimizer_app_v2_cloud")
-        location = geolocator.geocode(address)
-        if location:
-            return location.latitude, location.longitude
-        else:
-            return None, None
+        return _geocode_uncached(address)
     except Exception as e:
         st.warning(f"Geocoding failed (地址解析失败): {address} - {e}")
         return None, None
 
 
-def calculate_distance_from_addresses(address1, address2, cache={}):
-    """Calculate distance between two addresses with caching (中文: 计算两地址间距离，带缓存)"""
-    cache_key = f"{address1}|{address2}"
-    
-    if cache_key in cache:
-        return cache[cache_key]
-    
+def calculate_distance_matrix():
+    """Calculate distance matrix from warehouses to DCs (中文: 计算仓库到DC的距离矩阵)"""
+    warehouses = st.session_state.warehouses
+    dcs = st.session_state.distribution_centers
+
+    # Geocode every unique address once up front; only cache misses hit the network
+    unique_addresses = list(dict.fromkeys(warehouses['Address'].tolist() + dcs['Address'].tolist()))
+    progress_text = "Geocoding addresses (地址解析中)..."
+
+    if len(unique_addresses) > 10:
+        progress_bar = st.progress(0, text=progress_text)
+    else:
+        progress_bar = None
+
+    for i, address in enumerate(unique_addresses, start=1):
+        geocode_address(address)
+        if progress_bar:
+            progress_bar.progress(i / len(unique_addresses), text=progress_text)
+
+    if progress_bar:
+        progress_bar.empty()
+
+    wh_key = tuple(zip(warehouses['Name'].tolist(), warehouses['Address'].tolist()))
+    dc_key = tuple(zip(dcs['Channel'].tolist(), dcs['State'].tolist(), dcs['Address'].tolist()))
+    return calculate_distance_matrix_cached(wh_key, dc_key)
+
+
+def _pair_miles(address1, address2):
+    """Geodesic miles between two geocoded addresses; 500 when either cannot be located"""
     lat1, lon1 = geocode_address(address1)
     lat2, lon2 = geocode_address(address2)
-    
     if lat1 is None or lat2 is None:
-        cache[cache_key] = 500.0
         return 500.0
-    
-    distance = geodesic((lat1, lon1), (lat2, lon2)).miles
-    cache[cache_key] = distance
-    
-    return distance
+    return geodesic((lat1, lon1), (lat2, lon2)).miles
 
 
-def calculate_distance_matrix():
-    """Calculate distance matrix from warehouses to DCs (中文: 计算仓库到DC的距离矩阵)"""
-    warehouses = st.session_state.warehouses
-    dcs = st.session_state.distribution_centers
-    
-    distances = []
-    distance_cache = {}
+@st.cache_data(show_spinner=False)
+def calculate_distance_matrix_cached(wh_key, dc_key):
+    """
+    Warehouse x DC distance table keyed on (name, address) / (channel, state, address) tuples.
+    Cleared when warehouses or DCs are saved; geocodes come from the geocode_address cache.
+    """
+    n_dcs = len(dc_key)
+    if not len(wh_key) or not n_dcs:
+        return pd.DataFrame()
+
+    wh_cols = np.array(wh_key, dtype=object).reshape(-1, 2)
+    dc_cols = np.array(dc_key, dtype=object).reshape(-1, 3)
+
+    # Geodesic once per unique address pair, then broadcast onto the warehouse x DC grid
+    address_grid = pd.MultiIndex.from_product([pd.unique(wh_cols[:, 1]), pd.unique(dc_cols[:, 2])])
+    miles = pd.Series([_pair_miles(wh_address, dc_address) for wh_address, dc_address in address_grid],
+                      index=address_grid, dtype=np.float64)
+    pair_index = pd.MultiIndex.from_arrays([np.repeat(wh_cols[:, 1], n_dcs), np.tile(dc_cols[:, 2], len(wh_key))])
+    distances = miles.reindex(pair_index).to_numpy()
+
+    return pd.DataFrame({
+        'Warehouse': np.repeat(wh_cols[:, 0], n_dcs),
+        'Warehouse_Address': np.repeat(wh_cols[:, 1], n_dcs),
+        # Categorical DC keys: the per-demand Channel/State masks compare integer codes
+        'DC_Channel': pd.Categorical(np.tile(dc_cols[:, 0], len(wh_key))),
+        'DC_State': pd.Categorical(np.tile(dc_cols[:, 1], len(wh_key))),
+        'DC_Address': np.tile(dc_cols[:, 2], len(wh_key)),
+        'Distance_Miles': distances
+    })
+
+
+def _cost_kernel(dist, rate):
+    """Per-unit cost from float32 distances; the divide runs in place on the product buffer"""
+    cost = dist * np.float32(rate)
+    cost /= 100
+    return cost
+
+
+@st.cache_data(show_spinner=False)
+def calculate_shipping_costs(distance_matrix, rate_per_unit_per_100miles):
+    """Calculate shipping costs (中文: 计算运输成本)"""
+    return distance_matrix.assign(
+        Cost_Per_Unit=_cost_kernel(distance_matrix['Distance_Miles'].to_numpy(dtype=np.float32), rate_per_unit_per_100miles)
+    )
+
+
+def get_shipping_costs(rate_kind):
+    """
+    Shipping costs for every warehouse-DC pair at the 'market' (customer) or 'tms' (smart) rate
+    (中文: 按市场费率或TMS费率获取运输成本)
+    """
+    if rate_kind == 'market':
+        rate = st.session_state.market_shipping_rate
+    elif rate_kind == 'tms':
+        rate = st.session_state.tms_shipping_rate
+    else:
+        raise ValueError(f"Unknown rate kind: {rate_kind}")
+    return calculate_shipping_costs(calculate_distance_matrix(), rate)
+
+
+@st.cache_data(ttl=300, show_spinner=False)
+def compute_rate_table(dist_df, skus, cust_id, tms_id, veh_id, veh_name):
+    """
+    Customer vs TMS unit rate for every warehouse-DC pair and SKU (中文: 计算客户与TMS单位运费对比表)
+    Cached by carrier/vehicle IDs and SKU tuple; cleared whenever carriers, rates or SKUs change.
+    """
+    if dist_df.empty or not skus:
+        return pd.DataFrame()
     
-    total_pairs = len(warehouses) * len(dcs)
-    progress_text = "Calculating distances (计算距离中)..."
+    # One batched rate lookup per carrier instead of two DB round-trips per (pair, SKU)
+    distances = dist_df['Distance_Miles'].to_numpy(dtype=np.float64)
+    cust_rate, _ = db.calculate_unit_shipping_rate_matrix(skus, distances, cust_id, veh_id)
+    tms_rate, tms_max_units = db.calculate_unit_shipping_rate_matrix(skus, distances, tms_id, veh_id)
     
-    if total_pairs > 10:
-        progress_bar = st.progress(0, text=progress_text)
-    else:
-        progress_bar = None
+    # Rows are ordered pair-major, SKU-minor, as in the original nested loop
+    n_skus = len(skus)
+    return pd.DataFrame({
+        'Warehouse': np.repeat(dist_df['Warehouse'].to_numpy(), n_skus),
+        'DC': np.repeat((dist_df['DC_Channel'].astype(str) + '-' + dist_df['DC_State'].astype(str)).to_numpy(), n_skus),
+        'SKU': np.tile(np.asarray(skus, dtype=object), len(dist_df)),
+        'Distance': np.repeat(np.round(distances, 0), n_skus),
+        f'Max Units / {veh_name}': tms_max_units.ravel(),
+        'Customer Rate / ea': np.round(cust_rate.ravel(), 4),
+        'TMS Rate / ea': np.round(tms_rate.ravel(), 4),
+        'Savings / ea': np.round((cust_rate - tms_rate).ravel(), 4)
+    })
+
+
+def frame_stats(name, df, compute):
+    """
+    Summary numbers for a session-state frame, computed once per frame object (中文: 按数据表缓存汇总值)
+    Save/reset handlers replace the frame rather than mutating it, so a new object means new totals.
+    """
+    stats = st.session_state.setdefault('_frame_stats', {})
+    entry = stats.get(name)
+    if entry is None or entry[0] is not df:
+        entry = (df, compute(df))
+        stats[name] = entry
+    return entry[1]
+
+
+def frame_fingerprint(df):
+    """Columns plus a row-content hash (index ignored), for cheap "did this frame change" checks"""
+    return tuple(df.columns), pd.util.hash_pandas_object(df, index=False).values.tobytes()
+
+
+def _demand_totals(df):
+    """(Week 3 total, Week 4 total) demand; 0 for an empty forecast"""
+    if df.empty:
+        return 0, 0
+    return df['Demand_Week3'].sum(), df['Demand_Week4'].sum()
+
+
+def _json_default(obj):
+    """Encode values plain JSON can't: missing markers as null, numpy scalars as Python numbers"""
+    if obj is pd.NA or obj is pd.NaT:
+        return None
+    if isinstance(obj, np.generic):
+        return obj.item()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def config_to_json(config):
+    """Indented JSON for the configuration download; uses orjson when installed, else the json module"""
+    if orjson is not None:
+        return orjson.dumps(config, default=_json_default, option=orjson.OPT_INDENT_2 | orjson.OPT_SERIALIZE_NUMPY)
+    return json.dumps(config, indent=2, default=_json_default)
+
+
+# Parquet bundles need pyarrow, which is optional; without it only the JSON export is offered
+PARQUET_AVAILABLE = importlib.util.find_spec('pyarrow') is not None
+CONFIG_FRAMES = ('warehouses', 'distribution_centers', 'demand_forecast', 'customer_allocation_plan')
+
+
+def config_to_parquet_zip(frames, settings):
+    """
+    Zip of one zstd Parquet file per DataFrame plus settings.json for the scalar settings
+    (中文: 每个数据表一个Parquet文件，保留列类型)
+    """
+    buffer = BytesIO()
+    with zipfile.ZipFile(buffer, 'w') as bundle:
+        for name, df in frames.items():
+            part = BytesIO()
+            df.to_parquet(part, engine='pyarrow', compression='zstd', index=False)
+            bundle.writestr(f'{name}.parquet', part.getvalue())
+        bundle.writestr('settings.json', json.dumps(settings))
+    return buffer.getvalue()
+
+
+def config_from_parquet_zip(uploaded):
+    """Inverse of config_to_parquet_zip: settings keys plus one DataFrame per Parquet member"""
+    with zipfile.ZipFile(uploaded) as bundle:
+        config = json.loads(bundle.read('settings.json'))
+        for member in bundle.namelist():
+            name, ext = member.rsplit('.', 1) if '.' in member else (member, '')
+            if ext == 'parquet':
+                config[name] = pd.read_parquet(BytesIO(bundle.read(member)), engine='pyarrow')
+    return config
+
+
+def with_summary_row(df, summary):
+    """
+    Display copy of df with a TOTAL row appended (中文: 追加汇总行用于展示)
+    A single concat with a one-row frame; not cached, since hashing the input and unpickling
+    the cached result on every rerun costs more than the concat itself.
+    """
+    return pd.concat([df, pd.DataFrame([summary])], ignore_index=True)
+
+
+# Comparison detail tables: numeric columns are labelled and formatted by the grid itself,
+# so the allocation frame is shown as is, without a renamed or formatted copy
+DETAIL_COLUMNS = (
+    'Product', 'Warehouse', 'Channel', 'State', 'Allocated_Units', 'Allocated_Shipped',
+    'Cost_Per_Unit', 'Distance_Miles', 'Total_Cost'
+)
+DETAIL_COLUMN_CONFIG = {
+    'Allocated_Units': st.column_config.NumberColumn('Units', format='%.0f'),
+    'Allocated_Shipped': st.column_config.NumberColumn('Shipped', format='%.0f'),
+    'Cost_Per_Unit': st.column_config.NumberColumn('Rate ($/unit)', format='$%.4f'),
+    'Distance_Miles': st.column_config.NumberColumn('Distance (mi)', format='%.1f'),
+    'Total_Cost': st.column_config.NumberColumn('Cost', format='$%.2f')
+}
+
+
+@st.cache_data(show_spinner=False)
+def warehouse_summary(allocation_df):
+    """
+    Units and cost per warehouse for one week's allocation (中文: 按仓库汇总数量与成本)
+    Shared by Run Scenarios and Cost Comparison; cached on the allocation frame so reruns skip the groupby.
+    """
+    summary = allocation_df.groupby('Warehouse', observed=True, as_index=False).agg(
+        Total_Units=('Allocated_Units', 'sum'),
+        Total_Cost=('Total_Cost', 'sum')
+    )
+    summary.columns = ['Warehouse', 'Total Units', 'Total Cost ($)']
+    return summary
+
+
+
+@st.cache_data(show_spinner=False)
+def warehouse_pie(wh_summary, title):
+    """Share of units by warehouse, built once per summary (中文: 仓库分配占比饼图，按数据缓存)"""
+    import plotly.express as px  # deferred: only chart pages pay the plotly import
+    fig = px.pie(wh_summary, values='Total Units', names='Warehouse', title=title)
+    fig.update_layout(template='plotly_white', margin=dict(t=40, b=20, l=20, r=20))
+    return fig
+
+
+@st.cache_data(show_spinner=False)
+def warehouse_usage_bar(combined, week):
+    """Customer vs Smart units per warehouse for one week (中文: 仓库使用对比柱状图)"""
+    import plotly.express as px
+    fig = px.bar(combined, x='Warehouse', y='Total Units', color='Plan',
+                 barmode='group',
+                 title=f'Week {week} - Warehouse Usage Comparison',
+                 color_discrete_map={'Customer': '#EF4444', 'Smart': '#10B981'})
+    fig.update_layout(template='plotly_white', font=dict(family="Inter, sans-serif"))
+    return fig
+
+
+@st.cache_data(show_spinner=False)
+def weekly_cost_bar(customer_costs, smart_costs):
+    """Grouped Week 3/4 cost bars; costs are (week 3, week 4) tuples (中文: 按周成本对比柱状图)"""
+    import plotly.graph_objects as go
+    fig = go.Figure()
+    fig.add_trace(go.Bar(name='Customer Current', x=['Week 3', 'Week 4'],
+                         y=list(customer_costs), marker_color='#FF6B6B'))
+    fig.add_trace(go.Bar(name='Smart Solution', x=['Week 3', 'Week 4'],
+                         y=list(smart_costs), marker_color='#4ECDC4'))
+    fig.update_layout(title='Cost Comparison by Week (按周成本对比)',
+                      barmode='group',
+                      yaxis_title='Cost ($)',
+                      height=400,
+                      template='plotly_white',
+                      font=dict(family="Inter, sans-serif"))
+    return fig
+
+ALLOCATION_DETAIL_TEXT = {
+    'customer': {
+        'header': "📋 Customer Allocation Details",
+        'subheader': "Week {week} Customer Allocation (第{week}周客户分配)",
+        'cost_help': "Using Market rates. Cost reduced by available inventory. (使用市场费率，已扣除可用库存)",
+        'pie_title': "Week {week} Customer Allocation Distribution",
+        'missing': "⚠️ No results for Week {week}. Calculate customer cost first. (第{week}周无结果，请先计算客户成本)"
+    },
+    'smart': {
+        'header': "📋 Smart Allocation Details",
+        'subheader': "Week {week} Smart Allocation (第{week}周智能分配)",
+        'cost_help': "Using TMS rates. Cost reduced by available inventory. (使用TMS费率，已扣除可用库存)",
+        'pie_title': "Week {week} Allocation Distribution",
+        'missing': "⚠️ No results for Week {week}. Run optimization first. (第{week}周无结果，请先运行优化)"
+    }
+}
+
+
+def render_allocation_details(results, kind):
+    """
+    Week 3/4 result tabs for one scenario on the Run Scenarios page (中文: 渲染单个方案的分周结果)
+    kind is 'customer' or 'smart' and only selects the labels; both scenarios share this code path.
+    """
+    text = ALLOCATION_DETAIL_TEXT[kind]
+    st.markdown("---")
+    st.subheader(text['header'])
     
-    current_pair = 0
+    week_tabs = st.tabs(["Week 3 Results (第3周结果)", "Week 4 Results (第4周结果)"])
     
-    for _, wh in warehouses.iterrows():
-        wh_address = wh['Address']
-        
-        for _, dc in dcs.iterrows():
-            dc_address = dc['Address']
+    for tab, week in zip(week_tabs, (3, 4)):
+        with tab:
+            allocation_df, total_cost = results.get(week, (None, None))
             
-            dist = calculate_distance_from_addresses(wh_address, dc_address, distance_cache)
+            if allocation_df is None:
+                st.warning(text['missing'].format(week=week))
+                continue
             
-            distances.append({
-                'Warehouse': wh['Name'],
-                'Warehouse_Address': wh_address,
-                'DC_Channel': dc['Channel'],
-                'DC_State': dc['State'],
-                'DC_Address': dc_address,
-                'Distance_Miles': dist
-            })
+            st.subheader(text['subheader'].format(week=week))
+            
+            col1, col2 = st.columns([2, 1])
+            with col1:
+                st.metric("Total Cost (总成本)", f"${total_cost:,.2f}", help=text['cost_help'])
+            with col2:
+                st.metric("Total Units (总数量)", f"{allocation_df['Allocated_Units'].sum():,.0f}")
+            
+            st.markdown("**Allocation Details (分配详情)**")
+            display_alloc = allocation_df[['Product', 'Warehouse', 'Channel', 'State', 'Allocated_Units', 'Allocated_Shipped', 'Cost_Per_Unit', 'Total_Cost']].round(
+                {'Allocated_Units': 0, 'Allocated_Shipped': 0, 'Cost_Per_Unit': 3, 'Total_Cost': 2}
+            )
+            st.dataframe(display_alloc, use_container_width=True, hide_index=True)
             
-            current_pair += 1
-            if progress_bar:
-                progress_bar.progress(current_pair / total_pairs, text=progress_text)
+            # By warehouse summary
+            st.markdown("**By Warehouse (按仓库汇总)**")
+            wh_summary = warehouse_summary(allocation_df)
+            
+            col1, col2 = st.columns(2)
+            with col1:
+                st.dataframe(wh_summary, use_container_width=True, hide_index=True)
+            with col2:
+                st.plotly_chart(warehouse_pie(wh_summary, text['pie_title'].format(week=week)), use_container_width=True)
+
+
+@st.cache_data(show_spinner=False)
+def nearest_warehouse_by_dc(shipping_costs, selected_whs):
+    """(DC_Channel, DC_State) -> nearest of the selected warehouses, one idxmin per DC"""
+    routes = shipping_costs[shipping_costs['Warehouse'].isin(selected_whs)]
+    return routes.loc[
+        routes.groupby(['DC_Channel', 'DC_State'], observed=True)['Distance_Miles'].idxmin(),
+        ['DC_Channel', 'DC_State', 'Warehouse']
+    ]
+
+
+def build_nearest_plan(demand, shipping_costs, selected_whs):
+    """
+    Customer plan sending each demand row in full from its DC's nearest selected warehouse
+    (中文: 按最近的选定仓库生成客户方案). Demand with no reachable selected warehouse is dropped.
+    """
+    nearest = nearest_warehouse_by_dc(shipping_costs, selected_whs)
+    plan = demand.merge(nearest, left_on=['Channel', 'State'], right_on=['DC_Channel', 'DC_State'])
+    return plan.assign(
+        Allocated_Units_Week3=plan['Demand_Week3'],
+        Allocated_Units_Week4=plan['Demand_Week4']
+    )[['Product', 'Warehouse', 'Channel', 'State', 'Allocated_Units_Week3', 'Allocated_Units_Week4']]
+
+
+def validate_plan(demand, plan):
+    """
+    Compare allocated vs demanded units per demand row and week (中文: 校验方案是否满足需求).
+    One groupby over the plan replaces the per-row Channel/State masks; rows are ordered
+    demand row by demand row, Week 3 then Week 4.
+    """
+    alloc_cols = ['Allocated_Units_Week3', 'Allocated_Units_Week4']
+    plan = plan.reindex(columns=['Channel', 'State'] + alloc_cols)
+    alloc = plan.groupby(['Channel', 'State'], observed=True, sort=False)[alloc_cols].sum()
+    merged = demand[['Channel', 'State', 'Demand_Week3', 'Demand_Week4']].merge(
+        alloc, left_on=['Channel', 'State'], right_index=True, how='left'
+    )
     
-    if progress_bar:
-        progress_bar.empty()
+    req = merged[['Demand_Week3', 'Demand_Week4']].to_numpy()
+    allocated = merged[alloc_cols].fillna(0)
+    if all(pd.api.types.is_integer_dtype(dtype) for dtype in alloc.dtypes):
+        allocated = allocated.astype(np.int64)
+    allocated = allocated.to_numpy()
+    
+    diff = (allocated - req).ravel()
+    status = np.select(
+        [allocated.ravel() < req.ravel(), allocated.ravel() > req.ravel()],
+        [[f"❌ Low ({d:+.0f})" for d in diff], [f"⚠️ High ({d:+.0f})" for d in diff]],
+        default="✅ OK"
+    )
     
-    return pd.DataFrame(distances)
+    return pd.DataFrame({
+        'DC': np.repeat((merged['Channel'].astype(str) + '-' + merged['State'].astype(str)).to_numpy(), 2),
+        'Week': np.tile(['Week 3', 'Week 4'], len(merged)),
+        'Demand': req.ravel(),
+        'Allocated': allocated.ravel(),
+        'Status': status
+    })
 
 
-def calculate_shipping_costs(distance_matrix, rate_per_unit_per_100miles):
-    """Calculate shipping costs (中文: 计算运输成本)"""
-    costs = distance_matrix.copy()
-    costs['Cost_Per_Unit'] = costs['Distance_Miles'] * rate_per_unit_per_100miles / 100
-    return costs
+# st.fragment needs Streamlit >= 1.37; older versions simply render inline
+_fragment = getattr(st, 'fragment', None) or getattr(st, 'experimental_fragment', None) or (lambda func: func)
+
+
+@_fragment
+def render_rate_table(cust_id, tms_id, veh_id, veh_name, skus):
+    """
+    Calculated rate table with paging and averages (中文: 计算运费表).
+    Runs as a fragment, so paging through the table reruns only this block, not the whole page.
+    """
+    distance_matrix = calculate_distance_matrix()
+    rate_df = compute_rate_table(distance_matrix, skus, cust_id, tms_id, veh_id, veh_name)
+    if not rate_df.empty:
+        rate_columns = {
+            'Distance': st.column_config.NumberColumn(format='%d'),
+            'Customer Rate / ea': st.column_config.NumberColumn(format='$%.4f'),
+            'TMS Rate / ea': st.column_config.NumberColumn(format='$%.4f'),
+            'Savings / ea': st.column_config.NumberColumn(format='$%.4f')
+        }
+        
+        # Only one page of the W x DC x SKU table is serialized per rerun
+        n_pages = -(-len(rate_df) // RATE_TABLE_PAGE_SIZE)
+        if n_pages > 1:
+            page = st.number_input(
+                f"Page (页码, 1-{n_pages})", min_value=1, max_value=n_pages, value=1, step=1,
+                key="rate_table_page"
+            )
+            start = (page - 1) * RATE_TABLE_PAGE_SIZE
+            st.dataframe(rate_df.iloc[start:start + RATE_TABLE_PAGE_SIZE], width=TABLE_WIDTH, column_config=rate_columns)
+            st.caption(f"Rows {start + 1}-{min(start + RATE_TABLE_PAGE_SIZE, len(rate_df))} of {len(rate_df)}")
+        else:
+            st.dataframe(rate_df, width=TABLE_WIDTH, column_config=rate_columns)
+        
+        # Summary
+        avg_cust = rate_df['Customer Rate / ea'].mean()
+        avg_tms = rate_df['TMS Rate / ea'].mean()
+        avg_savings = rate_df['Savings / ea'].mean()
+        
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            st.metric("Avg Customer Rate", f"${avg_cust:.4f}")
+        with col2:
+            st.metric("Avg TMS Rate", f"${avg_tms:.4f}")
+        with col3:
+            st.metric("Avg Savings", f"${avg_savings:.4f}")
+
+
+@st.cache_data(show_spinner=False)
+def _available_inventory_both_weeks(schedule, inventory_df):
+    """
+    Available inventory for Week 3 and Week 4 from one schedule/inventory merge.
+    Week 4 reuses the Week 3 base (current + in_w3 - out_w1 - out_w2) plus in_w4.
+    """
+    on_hand = (
+        inventory_df.groupby(['warehouse_name', 'sku_code'], sort=False)['quantity_on_hand']
+        .sum()
+        .reset_index()
+    )
+    merged = schedule.merge(
+        on_hand, left_on=['Warehouse', 'SKU'], right_on=['warehouse_name', 'sku_code'], how='left'
+    )
+    current_inv = merged['quantity_on_hand'].fillna(0).astype(int)
+
+    base = current_inv + merged['Incoming_Week3'] - merged['Outgoing_Week1'] - merged['Outgoing_Week2']
+    week3 = pd.DataFrame({'Name': merged['Warehouse'], 'SKU': merged['SKU'], 'Available': base.clip(lower=0)})
+    week4 = week3.assign(Available=(base + merged['Incoming_Week4']).clip(lower=0))
+    return {3: week3, 4: week4}
 
 
 def calculate_available_inventory(week):
@@ -140,40 +551,65 @@ def calculate_available_inventory(week):
         warehouses = st.session_state.warehouses
         return warehouses[['Name']].copy().assign(Available=0)
     
-    # Get inventory data
-    inventory_df = st.session_state.get('warehouse_inventory', pd.DataFrame())
+    # Get inventory data (loaded on first use)
+    if 'warehouse_inventory' not in st.session_state:
+        db.reload_table('warehouse_inventory')
+    inventory_df = st.session_state.warehouse_inventory
     
-    # Calculate available for each warehouse
-    result = []
-    for wh in schedule['Warehouse'].unique():
-        wh_schedule = schedule[schedule['Warehouse'] == wh]
-        
-        for _, row in wh_schedule.iterrows():
-            sku = row.get('SKU', '32Q21K')
-            
-            # Get current inventory
-            inv_match = inventory_df[(inventory_df['warehouse_name'] == wh) & (inventory_df['sku_code'] == sku)]
-            current_inv = inv_match['quantity_on_hand'].sum() if not inv_match.empty else 0
-            
-            in_w3 = row.get('Incoming_Week3', 0)
-            in_w4 = row.get('Incoming_Week4', 0)
-            out_w1 = row.get('Outgoing_Week1', 0)
-            out_w2 = row.get('Outgoing_Week2', 0)
-            
-            if week == 3:
-                available = current_inv + in_w3 - out_w1 - out_w2
-            elif week == 4:
-                available = current_inv + in_w3 + in_w4 - out_w1 - out_w2
-            else:
-                available = current_inv
-            
-            result.append({
-                'Name': wh,
-                'SKU': sku,
-                'Available': max(0, available)
-            })
+    return _available_inventory_both_weeks(schedule, inventory_df)[week]
+
+
+# Route-level columns stay float32; the solver upcasts to float64 once at the linprog boundary.
+# Demand is float32 rather than int32 so blank rows from the data editor don't fail the cast.
+# Warehouse/Channel/State have a handful of distinct values, so routes carry them as categoricals
+# and every groupby over them passes observed=True.
+ALLOCATION_DTYPES = {
+    'Warehouse': 'category', 'Channel': 'category', 'State': 'category',
+    'Demand': 'float32', 'Cost_Per_Unit': 'float32', 'Distance_Miles': 'float32'
+}
+SMALL_LP_THRESHOLD = 10_000  # n_vars * n_constraints below which presolve is skipped
+
+
+def _allocation_result(allocation_df, x_inv, x_ship):
+    """Attach per-route solution columns to the route table, dropping unused routes"""
+    # Build the solution columns once and attach them, rather than copying the route table
+    solution = pd.DataFrame({
+        'Allocated_From_Inv': x_inv,
+        'Allocated_Shipped': x_ship,
+        'Allocated_Units': x_inv + x_ship,
+        # Total cost is only based on shipped units
+        'Total_Cost': x_ship * allocation_df['Cost_Per_Unit'].to_numpy()
+    }, index=allocation_df.index)
+    
+    # Filter small values
+    keep = solution['Allocated_Units'] > 0.01
+    return pd.concat([allocation_df[keep], solution[keep]], axis=1)
+
+
+def _cover_demand_from_inventory(allocation_df, pools):
+    """
+    Fast path for solve_lp_with_inventory: serve every demand from inventory alone,
+    cheapest route first. Returns x_inv per route, or None if any demand would still need shipping.
+    """
+    costs = allocation_df['Cost_Per_Unit'].to_numpy()
+    demands = allocation_df['Demand'].to_numpy()
+    warehouses = allocation_df['Warehouse'].to_numpy()
+    remaining = dict(pools)
+    x_inv = np.zeros(len(allocation_df))
     
-    return pd.DataFrame(result)
+    for positions in allocation_df.groupby(['Product', 'Channel', 'State'], observed=True, sort=False).indices.values():
+        need = demands[positions[0]]
+        for pos in positions[np.argsort(costs[positions], kind='stable')]:
+            take = min(need, remaining[warehouses[pos]])
+            x_inv[pos] = take
+            remaining[warehouses[pos]] -= take
+            need -= take
+            if need <= 0:
+                break
+        if need > 1e-6:
+            return None
+    
+    return x_inv
 
 
 def solve_lp_with_inventory(allocation_df, inventory_df, warehouses_df, ignore_capacity=False):
@@ -186,9 +622,26 @@ def solve_lp_with_inventory(allocation_df, inventory_df, warehouses_df, ignore_c
     n_routes = len(allocation_df)
     n_vars = 2 * n_routes  # Split variables
     
+    # Fast path: if inventory alone can cover every demand, nothing ships and cost is 0 (optimal),
+    # so HiGHS is skipped. Pools are per-warehouse inventory, capped by capacity when enforced.
+    pools = {}
+    for wh_name in allocation_df['Warehouse'].unique():
+        avail = inventory_df[inventory_df['Name'] == wh_name]['Available'].values
+        pool = max(0, avail[0] if len(avail) > 0 else 0)
+        if not ignore_capacity:
+            cap = warehouses_df[warehouses_df['Name'] == wh_name]['Capacity'].values
+            pool = min(pool, cap[0] if len(cap) > 0 else 100000)
+        pools[wh_name] = pool
+    
+    tot_demand = allocation_df.groupby(['Product', 'Channel', 'State'], observed=True, sort=False)['Demand'].first().sum()
+    if sum(pools.values()) >= tot_demand:
+        x_inv = _cover_demand_from_inventory(allocation_df, pools)
+        if x_inv is not None:
+            return _allocation_result(allocation_df, x_inv, np.zeros(n_routes)), 0.0
+    
     # Costs: 0 for inventory, Rate for shipping
     c_inv = np.zeros(n_routes)
-    c_ship = allocation_df['Cost_Per_Unit'].values
+    c_ship = allocation_df['Cost_Per_Unit'].to_numpy(dtype=np.float64)  # HiGHS works in float64
     c = np.concatenate([c_inv, c_ship])
     
     # Constraints lists
@@ -199,7 +652,7 @@ def solve_lp_with_inventory(allocation_df, inventory_df, warehouses_df, ignore_c
     
     # 1. Demand Constraints: x_inv + x_ship = Demand
     # Group by unique demand (Product, Channel, State)
-    unique_demands = allocation_df.groupby(['Product', 'Channel', 'State'])['Demand'].first()
+    unique_demands = allocation_df.groupby(['Product', 'Channel', 'State'], observed=True)['Demand'].first()
     
     for (product, channel, state), demand_val in unique_demands.items():
         constraint = np.zeros(n_vars)
@@ -246,102 +699,180 @@ def solve_lp_with_inventory(allocation_df, inventory_df, warehouses_df, ignore_c
             
     # Convert to numpy arrays
     A_eq = np.array(A_eq) if A_eq else None
-    b_eq = np.array(b_eq) if b_eq else None
+    b_eq = np.array(b_eq, dtype=np.float64) if b_eq else None
     A_ub = np.array(A_ub) if A_ub else None
-    b_ub = np.array(b_ub) if b_ub else None
+    b_ub = np.array(b_ub, dtype=np.float64) if b_ub else None
     
     bounds = [(0, None) for _ in range(n_vars)]
-    
+
+    # Small LPs: dual simplex without presolve beats HiGHS' auto method selection setup
+    n_constraints = (A_eq.shape[0] if A_eq is not None else 0) + (A_ub.shape[0] if A_ub is not None else 0)
+    if n_vars * n_constraints < SMALL_LP_THRESHOLD:
+        method = 'highs-ds'
+        options = {'presolve': False, 'dual_feasibility_tolerance': 1e-6}
+    else:
+        method = 'highs'
+        options = None
+
     # Solve
     try:
-        res = linprog(c, A_ub=A_ub, b_ub=b_ub, A_eq=A_eq, b_eq=b_eq, bounds=bounds, method='highs')
+        res = linprog(c, A_ub=A_ub, b_ub=b_ub, A_eq=A_eq, b_eq=b_eq, bounds=bounds, method=method, options=options)
         
         if res.success:
             # Extract results
             x_inv = res.x[:n_routes]
             x_ship = res.x[n_routes:]
             
-            result_df = allocation_df.copy()
-            result_df['Allocated_From_Inv'] = x_inv
-            result_df['Allocated_Shipped'] = x_ship
-            result_df['Allocated_Units'] = x_inv + x_ship
-            
-            # Total cost is only based on shipped units
-            result_df['Total_Cost'] = result_df['Allocated_Shipped'] * result_df['Cost_Per_Unit']
-            
-            # Filter small values
-            result_df = result_df[result_df['Allocated_Units'] > 0.01].copy()
-            
-            return result_df, res.fun
+            return _allocation_result(allocation_df, x_inv, x_ship), res.fun
     except Exception as e:
         st.error(f"Optimization failed: {e}")
         return None, 0
     return None, 0
 
-def optimize_allocation_multi_week():
+def greedy_fill_from_inventory(allocation_df, inventory_df):
     """
-    Optimize allocation for both Week 3 and Week 4
-    Logic: Calculate how much to ship TO each warehouse to meet demand
-    (中文: 优化第3周和第4周的分配 - 计算需要发货到每个仓库的量来满足需求)
+    Greedy inventory deduction: within each warehouse, cover the most expensive routes first
+    until that warehouse's available inventory runs out. Returns units from inventory per row.
+    (中文: 按仓库优先用库存覆盖单价最高的线路)
+    """
+    # First inventory row per warehouse, as the per-warehouse pool
+    pools = inventory_df.drop_duplicates('Name').set_index('Name')['Available']
+    
+    ordered = allocation_df.sort_values(['Warehouse', 'Cost_Per_Unit'], ascending=[True, False], kind='stable')
+    units = ordered['Allocated_Units']
+    covered_before = ordered.groupby('Warehouse', observed=True, sort=False)['Allocated_Units'].cumsum() - units
+    remaining = (ordered['Warehouse'].astype(object).map(pools).fillna(0) - covered_before).clip(lower=0)
+    
+    # Align back to the caller's row order
+    return np.minimum(units, remaining).reindex(allocation_df.index)
+
+
+def _build_allocation_df(demand, shipping_costs, inventory, week):
+    """One row per (demand, candidate warehouse) route for the LP (中文: 构建线路候选表)"""
+    routes = demand[['Product', 'Channel', 'State', f'Demand_Week{week}']].merge(
+        shipping_costs[['Warehouse', 'DC_Channel', 'DC_State', 'Cost_Per_Unit', 'Distance_Miles']],
+        left_on=['Channel', 'State'], right_on=['DC_Channel', 'DC_State']
+    )
+    if routes.empty:
+        return routes
+    
+    # Current available inventory per warehouse (first inventory row, as the LP uses)
+    available = inventory.drop_duplicates('Name').set_index('Name')['Available']
+    allocation_df = pd.DataFrame({
+        'Product': routes['Product'],
+        'Warehouse': routes['Warehouse'],
+        'Channel': routes['Channel'],
+        'State': routes['State'],
+        'Demand': routes[f'Demand_Week{week}'],
+        'Cost_Per_Unit': routes['Cost_Per_Unit'],
+        'Distance_Miles': routes['Distance_Miles'],
+        'Current_Available': routes['Warehouse'].map(available).fillna(0)
+    })
+    return allocation_df.astype(ALLOCATION_DTYPES)
+
+
+def _price_customer_plan(customer_plan, shipping_costs, inventory, week):
+    """Cost the configured customer plan for one week, deducting inventory greedily"""
+    alloc_col = f'Allocated_Units_Week{week}'
+    
+    # First route per (Warehouse, DC), joined onto the plan rows in one merge; rows without a route drop out
+    routes = shipping_costs[['Warehouse', 'DC_Channel', 'DC_State', 'Cost_Per_Unit', 'Distance_Miles']].drop_duplicates(
+        ['Warehouse', 'DC_Channel', 'DC_State']
+    )
+    priced = customer_plan[['Product', 'Warehouse', 'Channel', 'State', alloc_col]].merge(
+        routes, left_on=['Warehouse', 'Channel', 'State'], right_on=['Warehouse', 'DC_Channel', 'DC_State']
+    )
+    
+    # Columnar build: one array per column rather than a dict per row
+    customer_df = pd.DataFrame({
+        'Product': priced['Product'],
+        'Warehouse': priced['Warehouse'],
+        'Channel': priced['Channel'],
+        'State': priced['State'],
+        'Allocated_Units': priced[alloc_col],
+        'Cost_Per_Unit': priced['Cost_Per_Unit'],
+        'Distance_Miles': priced['Distance_Miles'],
+        # Initial total cost, will be adjusted below
+        'Total_Cost_Raw': priced[alloc_col] * priced['Cost_Per_Unit']
+    })
+    
+    if customer_df.empty:
+        return customer_df, 0
+    
+    # Apply inventory deduction logic manually
+    # For each warehouse, deduct available inventory from allocations (prioritizing expensive routes)
+    from_inv = greedy_fill_from_inventory(customer_df, inventory)
+    customer_df['Allocated_Shipped'] = customer_df['Allocated_Units'] - from_inv
+    customer_df['Allocated_From_Inv'] = from_inv.astype(float)
+    
+    customer_df['Total_Cost'] = customer_df['Allocated_Shipped'] * customer_df['Cost_Per_Unit']
+    return customer_df, customer_df['Total_Cost'].sum()
+
+
+def _run_allocation(mode, selected_whs=None):
+    """
+    Shared Week 3 / Week 4 allocation pipeline (中文: 统一的分配计算流程)
+    - 'tms_opt':     LP over all warehouses at TMS rates, capacity enforced
+    - 'cust_auto':   LP over the selected customer warehouses at market rates, capacity ignored
+    - 'cust_manual': cost the configured customer plan at market rates
+    Returns {3: (df, cost), 4: (df, cost)}
     """
     warehouses = st.session_state.warehouses
     demand = st.session_state.demand_forecast
-    distance_matrix = calculate_distance_matrix()
+    shipping_costs = get_shipping_costs('tms' if mode == 'tms_opt' else 'market')
+    customer_plan = None
+    
+    if mode == 'cust_auto':
+        # Use provided selection or fallback to all defaults
+        if selected_whs is None:
+            selected_whs = st.session_state.get('customer_selected_warehouses', warehouses['Name'].tolist())
+        if not selected_whs:
+            st.warning("⚠️ No Customer Default warehouses selected.")
+            return {3: (None, 0), 4: (None, 0)}
+        shipping_costs = shipping_costs[shipping_costs['Warehouse'].isin(selected_whs)]
     
-    rate = st.session_state.tms_shipping_rate
-    shipping_costs = calculate_shipping_costs(distance_matrix, rate)
+    elif mode == 'cust_manual':
+        customer_plan = st.session_state.customer_allocation_plan
+        customer_default_warehouses = set(st.session_state.get('customer_selected_warehouses', []))
+        
+        # Warn once (not per row and week) about routes using non-default warehouses
+        offenders = customer_plan.loc[
+            ~customer_plan['Warehouse'].isin(customer_default_warehouses), ['Warehouse', 'Channel', 'State']
+        ].drop_duplicates()
+        if not offenders.empty:
+            routes = ", ".join(f"{r.Warehouse} for {r.Channel}-{r.State}" for r in offenders.itertuples(index=False))
+            st.warning(f"⚠️ Not Customer Default warehouses: {routes}")
     
+    # Get available inventory for each week (what's already in warehouse)
+    inventories = {week: calculate_available_inventory(week) for week in [3, 4]}
+    return _allocate_weeks(mode, warehouses, demand, shipping_costs, inventories, customer_plan)
+
+
+@st.cache_data(show_spinner=False)
+def _allocate_weeks(mode, warehouses, demand, shipping_costs, inventories, customer_plan):
+    """
+    Week 3 / Week 4 solve for _run_allocation, memoized on its input frames so repeat clicks
+    with unchanged warehouses, demand, rates, inventory and plan skip the LP entirely.
+    """
     results = {}
     
     for week in [3, 4]:
-        demand_col = f'Demand_Week{week}'
-        
-        # Get available inventory for this week (what's already in warehouse)
-        inventory = calculate_available_inventory(week)
-        
-        allocation_data = []
+        inventory = inventories[week]
         
-        for _, d in demand.iterrows():
-            channel = d['Channel']
-            state = d['State']
-            demand_units = d[demand_col]
-            product = d['Product']
-            
-            # Find all warehouse-DC pairs for this demand
-            relevant_costs = shipping_costs[
-                (shipping_costs['DC_Channel'] == channel) & 
-                (shipping_costs['DC_State'] == state)
-            ]
-            
-            for _, cost in relevant_costs.iterrows():
-                wh_name = cost['Warehouse']
-                
-                # Get current available inventory for this warehouse
-                wh_inventory = inventory[inventory['Name'] == wh_name]['Available'].values
-                if len(wh_inventory) > 0:
-                    current_available = wh_inventory[0]
-                else:
-                    current_available = 0
-                
-                allocation_data.append({
-                    'Product': product,
-                    'Warehouse': wh_name,
-                    'Channel': channel,
-                    'State': state,
-                    'Demand': demand_units,
-                    'Cost_Per_Unit': cost['Cost_Per_Unit'],
-                    'Distance_Miles': cost['Distance_Miles'],
-                    'Current_Available': current_available
-                })
+        if mode == 'cust_manual':
+            results[week] = _price_customer_plan(customer_plan, shipping_costs, inventory, week)
+            continue
         
-        allocation_df = pd.DataFrame(allocation_data)
+        allocation_df = _build_allocation_df(demand, shipping_costs, inventory, week)
         
         if allocation_df.empty:
-            results[week] = (None, None)
+            results[week] = (None, 0)
             continue
         
-        # Use new solver with inventory logic
-        result_df, total_cost = solve_lp_with_inventory(allocation_df, inventory, warehouses)
+        # Customer plan ignores capacity: the customer forces shipment from its warehouses
+        result_df, total_cost = solve_lp_with_inventory(
+            allocation_df, inventory, warehouses, ignore_capacity=(mode == 'cust_auto')
+        )
         
         if result_df is not None:
             results[week] = (result_df, total_cost)
@@ -352,6 +883,38 @@ def optimize_allocation_multi_week():
     return results
 
 
+def results_total(results):
+    """Sum of weekly costs in a {week: (allocation_df, cost)} result, skipping weeks without a cost"""
+    return sum(cost for _, cost in results.values() if cost is not None)
+
+
+def results_stats(results):
+    """
+    Per-week scalars the comparison insights need, computed once when results are stored.
+    Every week with a result frame gets an entry; an empty frame (e.g. all-zero demand) gives NaN / 0 / 0.
+    """
+    return {
+        week: {
+            'avg_dist': np.nan, 'n_wh': 0, 'total_units': 0
+        } if df.empty else {
+            'avg_dist': df['Distance_Miles'].mean(),
+            'n_wh': df['Warehouse'].nunique(),
+            'total_units': df['Allocated_Units'].to_numpy().sum()
+        }
+        for week, (df, _) in results.items()
+        if df is not None
+    }
+
+
+def optimize_allocation_multi_week():
+    """
+    Optimize allocation for both Week 3 and Week 4
+    Logic: Calculate how much to ship TO each warehouse to meet demand
+    (中文: 优化第3周和第4周的分配 - 计算需要发货到每个仓库的量来满足需求)
+    """
+    return _run_allocation('tms_opt')
+
+
 def calculate_customer_cost_multi_week():
     """
     Calculate customer current cost for both weeks
@@ -365,94 +928,7 @@ def calculate_customer_cost_multi_week():
 
 def calculate_customer_cost_manual():
     """Use manually configured customer allocation plan (使用手动配置的方案)"""
-    customer_plan = st.session_state.customer_allocation_plan
-    distance_matrix = calculate_distance_matrix()
-    
-    rate = st.session_state.market_shipping_rate
-    shipping_costs = calculate_shipping_costs(distance_matrix, rate)
-    
-    # Get customer default warehouses for validation
-    customer_default_warehouses = st.session_state.get('customer_selected_warehouses', [])
-    warehouses_df = st.session_state.warehouses
-    
-    results = {}
-    
-    for week in [3, 4]:
-        alloc_col = f'Allocated_Units_Week{week}'
-        
-        customer_allocation = []
-        inventory = calculate_available_inventory(week)
-        
-        for _, plan in customer_plan.iterrows():
-            product = plan['Product']
-            warehouse = plan['Warehouse']
-            channel = plan['Channel']
-            state = plan['State']
-            allocated_units = plan[alloc_col]
-            
-            # Warning if using non-default warehouse
-            if warehouse not in customer_default_warehouses:
-                st.warning(f"⚠️ {warehouse} for {channel}-{state} is not a Customer Default warehouse")
-            
-            cost_info = shipping_costs[
-                (shipping_costs['Warehouse'] == warehouse) &
-                (shipping_costs['DC_Channel'] == channel) &
-                (shipping_costs['DC_State'] == state)
-            ]
-            
-            if not cost_info.empty:
-                cost_per_unit = cost_info.iloc[0]['Cost_Per_Unit']
-                distance = cost_info.iloc[0]['Distance_Miles']
-                
-                customer_allocation.append({
-                    'Product': product,
-                    'Warehouse': warehouse,
-                    'Channel': channel,
-                    'State': state,
-                    'Allocated_Units': allocated_units,
-                    'Cost_Per_Unit': cost_per_unit,
-                    'Distance_Miles': distance,
-                    # Initial total cost, will be adjusted below
-                    'Total_Cost_Raw': allocated_units * cost_per_unit
-                })
-        
-        customer_df = pd.DataFrame(customer_allocation)
-        
-        if not customer_df.empty:
-            # Apply inventory deduction logic manually
-            # For each warehouse, deduct available inventory from allocations (prioritizing expensive routes)
-            customer_df['Allocated_Shipped'] = customer_df['Allocated_Units'] # Default all shipped
-            customer_df['Allocated_From_Inv'] = 0.0
-            
-            for wh in customer_df['Warehouse'].unique():
-                # Get available inventory
-                avail = inventory[inventory['Name'] == wh]['Available'].values
-                avail_val = avail[0] if len(avail) > 0 else 0
-                
-                if avail_val > 0:
-                    # Get allocations for this warehouse, sorted by cost desc
-                    wh_mask = customer_df['Warehouse'] == wh
-                    wh_allocs = customer_df[wh_mask].sort_values('Cost_Per_Unit', ascending=False)
-                    
-                    for idx, row in wh_allocs.iterrows():
-                        needed = row['Allocated_Units']
-                        can_cover = min(needed, avail_val)
-                        
-                        customer_df.at[idx, 'Allocated_From_Inv'] = can_cover
-                        customer_df.at[idx, 'Allocated_Shipped'] = needed - can_cover
-                        
-                        avail_val -= can_cover
-                        if avail_val <= 0:
-                            break
-            
-            customer_df['Total_Cost'] = customer_df['Allocated_Shipped'] * customer_df['Cost_Per_Unit']
-            total_cost = customer_df['Total_Cost'].sum()
-        else:
-            total_cost = 0
-        
-        results[week] = (customer_df, total_cost)
-    
-    return results
+    return _run_allocation('cust_manual')
 
 
 def calculate_customer_cost_auto(selected_warehouses=None):
@@ -464,84 +940,7 @@ def calculate_customer_cost_auto(selected_warehouses=None):
     We assume the customer forces shipment from these locations (implying replenishment if needed),
     which highlights the high cost of suboptimal warehouse selection.
     """
-    warehouses = st.session_state.warehouses
-    demand = st.session_state.demand_forecast
-    distance_matrix = calculate_distance_matrix()
-    
-    rate = st.session_state.market_shipping_rate
-    shipping_costs = calculate_shipping_costs(distance_matrix, rate)
-    
-    # Use provided selection or fallback to all defaults
-    if selected_warehouses is None:
-        target_warehouses = st.session_state.get('customer_selected_warehouses', warehouses['Name'].tolist())
-    else:
-        target_warehouses = selected_warehouses
-    
-    if not target_warehouses:
-        st.warning("⚠️ No Customer Default warehouses selected.")
-        return {3: (None, 0), 4: (None, 0)}
-    
-    results = {}
-    
-    for week in [3, 4]:
-        demand_col = f'Demand_Week{week}'
-        
-        # Get available inventory (just for reference in result, not for constraint)
-        inventory = calculate_available_inventory(week)
-        
-        allocation_data = []
-        
-        # For each demand (DC), consider only the selected warehouses
-        for _, d in demand.iterrows():
-            channel = d['Channel']
-            state = d['State']
-            demand_units = d[demand_col]
-            product = d['Product']
-            
-            # Find shipping costs from target warehouses to this DC
-            relevant_costs = shipping_costs[
-                (shipping_costs['DC_Channel'] == channel) & 
-                (shipping_costs['DC_State'] == state) &
-                (shipping_costs['Warehouse'].isin(target_warehouses))
-            ]
-            
-            for _, cost in relevant_costs.iterrows():
-                wh_name = cost['Warehouse']
-                
-                # Get current available inventory
-                wh_inventory = inventory[inventory['Name'] == wh_name]['Available'].values
-                if len(wh_inventory) > 0:
-                    current_available = wh_inventory[0]
-                else:
-                    current_available = 0
-                
-                allocation_data.append({
-                    'Product': product,
-                    'Warehouse': wh_name,
-                    'Channel': channel,
-                    'State': state,
-                    'Demand': demand_units,
-                    'Cost_Per_Unit': cost['Cost_Per_Unit'],
-                    'Distance_Miles': cost['Distance_Miles'],
-                    'Current_Available': current_available
-                })
-        
-        allocation_df = pd.DataFrame(allocation_data)
-        
-        if allocation_df.empty:
-            results[week] = (None, 0)
-            continue
-        
-        # Use new solver with inventory logic (ignore capacity for customer plan)
-        result_df, total_cost = solve_lp_with_inventory(allocation_df, inventory, warehouses, ignore_capacity=True)
-        
-        if result_df is not None:
-            results[week] = (result_df, total_cost)
-        else:
-            st.error(f"Optimization failed for Week {week}")
-            results[week] = (None, 0)
-    
-    return results
+    return _run_allocation('cust_auto', selected_warehouses)
 
 
 # UI Layout
@@ -592,19 +991,22 @@ if page == "📊 Configuration":
     ])
     
     with tab1:
+        wh_df = st.session_state.warehouses
+        demand_df = st.session_state.demand_forecast
+        demand_w3, demand_w4 = frame_stats('demand_totals', demand_df, _demand_totals)
+        
         st.subheader("Warehouse Management (仓库管理)")
         
         # Display current warehouses
         st.markdown("**Current Warehouses (当前仓库列表)**")
-        display_wh = st.session_state.warehouses.copy()
+        display_wh = wh_df
         
         # Add summary row
-        summary_row = pd.DataFrame({
-            'Name': ['** TOTAL **'],
-            'Address': ['All Warehouses'],
-            'Capacity': [st.session_state.warehouses['Capacity'].sum()]
+        display_wh_with_summary = with_summary_row(display_wh, {
+            'Name': '** TOTAL **',
+            'Address': 'All Warehouses',
+            'Capacity': display_wh['Capacity'].sum()
         })
-        display_wh_with_summary = pd.concat([display_wh, summary_row], ignore_index=True)
         
         st.dataframe(display_wh_with_summary, use_container_width=True, hide_index=True)
         
@@ -614,7 +1016,7 @@ if page == "📊 Configuration":
             st.markdown("**Note: Inventory is managed in 'Inventory' tab**")
             
             edited_wh = st.data_editor(
-                st.session_state.warehouses,
+                wh_df,
                 num_rows="dynamic",
                 use_container_width=True,
                 column_config={
@@ -629,6 +1031,7 @@ if page == "📊 Configuration":
                 if st.button("💾 Save Changes (保存更改)", type="primary", use_container_width=True):
                     db.save_warehouses_df(edited_wh)
                     st.session_state.warehouses = edited_wh
+                    calculate_distance_matrix_cached.clear()
                     st.session_state.success_msg = "✅ Warehouses saved successfully!"
                     st.rerun()
             
@@ -675,7 +1078,7 @@ if page == "📊 Configuration":
             
             # Additional metrics
             total_available_w3 = inv3['Available'].sum()
-            total_demand_w3 = st.session_state.demand_forecast['Demand_Week3'].sum() if not st.session_state.demand_forecast.empty else 0
+            total_demand_w3 = demand_w3
             coverage_w3 = (total_available_w3 / total_demand_w3 * 100) if total_demand_w3 > 0 else 0
             
             col_a, col_b = st.columns(2)
@@ -703,7 +1106,7 @@ if page == "📊 Configuration":
             
             # Additional metrics
             total_available_w4 = inv4['Available'].sum()
-            total_demand_w4 = st.session_state.demand_forecast['Demand_Week4'].sum() if not st.session_state.demand_forecast.empty else 0
+            total_demand_w4 = demand_w4
             coverage_w4 = (total_available_w4 / total_demand_w4 * 100) if total_demand_w4 > 0 else 0
             
             col_a, col_b = st.columns(2)
@@ -722,13 +1125,12 @@ if page == "📊 Configuration":
         # Display current DCs
         st.markdown("**Current Distribution Centers (当前配送中心列表)**")
         
-        dc_display = st.session_state.distribution_centers.copy()
-        summary_row = pd.DataFrame({
-            'Channel': [f'** TOTAL: {len(dc_display)} DCs **'],
-            'State': [f'{dc_display["State"].nunique()} States'],
-            'Address': ['Multiple Locations']
+        dc_display = st.session_state.distribution_centers
+        dc_with_summary = with_summary_row(dc_display, {
+            'Channel': f'** TOTAL: {len(dc_display)} DCs **',
+            'State': f'{dc_display["State"].nunique()} States',
+            'Address': 'Multiple Locations'
         })
-        dc_with_summary = pd.concat([dc_display, summary_row], ignore_index=True)
         
         st.dataframe(dc_with_summary, use_container_width=True, hide_index=True)
         
@@ -749,7 +1151,9 @@ if page == "📊 Configuration":
             col1, col2 = st.columns(2)
             with col1:
                 if st.button("💾 Save DC Changes (保存DC更改)", type="primary", use_container_width=True):
+                    db.bulk_save_dcs(edited_dc)
                     st.session_state.distribution_centers = edited_dc
+                    calculate_distance_matrix_cached.clear()
                     st.session_state.success_msg = "✅ Distribution Centers saved! (配送中心已保存!)"
                     st.rerun()
             
@@ -772,10 +1176,10 @@ if page == "📊 Configuration":
         # Display current SKUs
         st.markdown("**Current SKUs (当前SKU列表)**")
         
-        sku_display = st.session_state.sku.copy()
+        sku_df = st.session_state.sku
+        sku_display = sku_df
         if not sku_display.empty:
-            # Add volumetric weight column
-            sku_display['Dim_Weight'] = (sku_display['length_in'] * sku_display['width_in'] * sku_display['height_in']) / 139
+            # Dim_Weight (volumetric weight) is computed once when SKUs are loaded
             st.dataframe(sku_display, use_container_width=True)
             
             # Summary
@@ -783,7 +1187,8 @@ if page == "📊 Configuration":
             with col1:
                 st.metric("Total SKUs", len(sku_display))
             with col2:
-                st.metric("Avg Weight", f"{sku_display['weight_lbs'].mean():.1f} lbs")
+                avg_weight = frame_stats('sku_avg_weight', sku_df, lambda df: df['weight_lbs'].mean())
+                st.metric("Avg Weight", f"{avg_weight:.1f} lbs")
         else:
             st.warning("No SKUs found")
         
@@ -809,6 +1214,8 @@ if page == "📊 Configuration":
                     if new_sku_code:
                         success, msg = db.add_sku(new_sku_code, new_sku_name, new_length, new_width, new_height, new_weight, new_unit_type)
                         if success:
+                            db.reload_table('sku')
+                            compute_rate_table.clear()
                             st.success(msg)
                             st.rerun()
                         else:
@@ -818,14 +1225,17 @@ if page == "📊 Configuration":
         
         # Edit/Delete SKU
         with st.expander("✏️ Edit/Delete SKU (编辑/删除SKU)", expanded=False):
-            if not st.session_state.sku.empty:
+            if not sku_df.empty:
                 # Let user select SKU to edit
-                sku_options = {f"{row['sku_code']} - {row['name']}": row['id'] for _, row in st.session_state.sku.iterrows()}
+                sku_options = {
+                    f"{code} - {name}": sku_id
+                    for code, name, sku_id in zip(sku_df['sku_code'].tolist(), sku_df['name'].tolist(), sku_df['id'].tolist())
+                }
                 selected_sku = st.selectbox("Select SKU to Edit", options=list(sku_options.keys()))
                 
                 if selected_sku:
                     sku_id = sku_options[selected_sku]
-                    sku_row = st.session_state.sku[st.session_state.sku['id'] == sku_id].iloc[0]
+                    sku_row = sku_df[sku_df['id'] == sku_id].iloc[0]
                     
                     with st.form("edit_sku_form"):
                         edit_sku_code = st.text_input("SKU Code", value=sku_row['sku_code'])
@@ -845,11 +1255,15 @@ if page == "📊 Configuration":
                         
                         if save_sku:
                             db.update_sku(sku_id, edit_sku_code, edit_sku_name, edit_length, edit_width, edit_height, edit_weight, edit_unit)
+                            db.reload_table('sku')
+                            compute_rate_table.clear()
                             st.success("SKU updated!")
                             st.rerun()
                         
                         if delete_sku:
                             db.delete_sku(sku_id)
+                            db.reload_table('sku')
+                            compute_rate_table.clear()
                             st.success("SKU deleted!")
                             st.rerun()
 
@@ -878,6 +1292,7 @@ if page == "📊 Configuration":
                     if carrier_name:
                         success, msg = db.add_carrier(carrier_name, carrier_mode, carrier_desc)
                         if success:
+                            db.reload_table('carriers')
                             st.success(msg)
                             st.rerun()
                         else:
@@ -891,9 +1306,10 @@ if page == "📊 Configuration":
         st.markdown("**Rates (费率表)**")
         rates_df = st.session_state.rates
         if not rates_df.empty:
-            display_rates = rates_df.copy()
-            display_rates['rate_range'] = display_rates.apply(
-                lambda x: f"{x['min_distance']:.0f}-{x['max_distance']:.0f}", axis=1
+            # Vectorized string build (Int64 tolerates missing bounds)
+            display_rates = rates_df.assign(
+                rate_range=rates_df['min_distance'].round().astype('Int64').astype(str) + '-'
+                + rates_df['max_distance'].round().astype('Int64').astype(str)
             )
             st.dataframe(display_rates[['carrier_name', 'mode', 'rate_range', 'rate_per_mile', 'minimum_charge', 'fixed_cost']], 
                         use_container_width=True)
@@ -901,11 +1317,11 @@ if page == "📊 Configuration":
             # Summary
             col1, col2, col3 = st.columns(3)
             with col1:
-                st.metric("Total Carriers", carriers_df['name'].nunique() if not carriers_df.empty else 0)
+                st.metric("Total Carriers", frame_stats('carrier_count', carriers_df, lambda df: df['name'].nunique()))
             with col2:
                 st.metric("Total Rate Rules", len(rates_df))
             with col3:
-                avg_rate = rates_df['rate_per_mile'].mean() if not rates_df.empty else 0
+                avg_rate = frame_stats('avg_rate_per_mile', rates_df, lambda df: df['rate_per_mile'].mean())
                 st.metric("Avg Rate/mile", f"${avg_rate:.2f}")
         
         # Add new Rate
@@ -915,7 +1331,10 @@ if page == "📊 Configuration":
                     col1, col2 = st.columns(2)
                     with col1:
                         # Carrier selection
-                        carrier_options = {f"{row['name']} ({row['mode']})": row['id'] for _, row in carriers_df.iterrows()}
+                        carrier_options = dict(zip(
+                            (carriers_df['name'].astype(str) + ' (' + carriers_df['mode'].astype(str) + ')').tolist(),
+                            carriers_df['id'].tolist()
+                        ))
                         selected_carrier = st.selectbox("Select Carrier", options=list(carrier_options.keys()))
                         min_dist = st.number_input("Min Distance (miles)", min_value=0, value=0)
                         max_dist = st.number_input("Max Distance (miles)", min_value=1, value=500)
@@ -930,6 +1349,8 @@ if page == "📊 Configuration":
                         if selected_carrier:
                             carrier_id = carrier_options[selected_carrier]
                             db.add_rate(carrier_id, min_dist, max_dist, rate_per_mile, minimum, fixed_cost)
+                            db.reload_table('rates')
+                            compute_rate_table.clear()
                             st.success("Rate added!")
                             st.rerun()
                         else:
@@ -940,24 +1361,34 @@ if page == "📊 Configuration":
         # Delete Rate
         with st.expander("🗑️ Delete Rate Rule", expanded=False):
             if not rates_df.empty:
-                rate_options = {f"{row['carrier_name']} ({row['min_distance']}-{row['max_distance']} mi, ${row['rate_per_mile']}/mi)": row['id'] 
-                              for _, row in rates_df.iterrows()}
+                rate_options = {
+                    f"{carrier} ({lo}-{hi} mi, ${per_mile}/mi)": rate_id
+                    for carrier, lo, hi, per_mile, rate_id in zip(
+                        rates_df['carrier_name'].tolist(), rates_df['min_distance'].tolist(),
+                        rates_df['max_distance'].tolist(), rates_df['rate_per_mile'].tolist(), rates_df['id'].tolist()
+                    )
+                }
                 selected_rate = st.selectbox("Select Rate to Delete", options=list(rate_options.keys()))
                 
                 if st.button("Delete Selected Rate", type="primary"):
                     db.delete_rate(rate_options[selected_rate])
+                    db.reload_table('rates')
+                    compute_rate_table.clear()
                     st.success("Rate deleted!")
                     st.rerun()
 
     # ======== NEW: Inventory Tab ========
     with tab5:
+        wh_df = st.session_state.warehouses
+        sku_df = st.session_state.sku
+        
         st.subheader("Warehouse Inventory & Schedule (仓库库存与调度)")
         
         st.info("💡 按仓库+SKU维护库存和入/出库计划")
         
         # Load warehouse schedule
         if 'warehouse_schedule' not in st.session_state:
-            st.session_state.warehouse_schedule = db.get_warehouse_schedule()
+            db.reload_table('warehouse_schedule')
         
         # Display warehouse schedule
         st.markdown("**Warehouse Schedule (仓库调度计划)**")
@@ -971,22 +1402,17 @@ if page == "📊 Configuration":
             st.markdown("**📊 Available Inventory Projection (可用库存预测)**")
             
             # Calculate available for each warehouse-SKU
-            warehouses_list = st.session_state.warehouses['Name'].tolist()
-            skus_list = st.session_state.sku['sku_code'].tolist()
+            warehouses_list = wh_df['Name'].tolist()
+            skus_list = sku_df['sku_code'].tolist()
             
-            available_data = []
-            for wh in warehouses_list:
-                for sku in skus_list:
-                    avail_w3 = db.calculate_available_inventory(wh, sku, 3)
-                    avail_w4 = db.calculate_available_inventory(wh, sku, 4)
-                    available_data.append({
-                        'Warehouse': wh,
-                        'SKU': sku,
-                        'Available_Week3': avail_w3,
-                        'Available_Week4': avail_w4
-                    })
-            
-            avail_df = pd.DataFrame(available_data)
+            # One query for the whole grid; warehouse-SKU pairs without a schedule show 0
+            availability = db.get_availability_matrix().set_index(['warehouse_name', 'sku_code'])
+            grid = pd.MultiIndex.from_product([warehouses_list, skus_list], names=['Warehouse', 'SKU'])
+            avail_df = (
+                availability[['Available_Week3', 'Available_Week4']]
+                .reindex(grid, fill_value=0)
+                .reset_index()
+            )
             if not avail_df.empty:
                 # Add totals
                 total_row = pd.DataFrame([{
@@ -996,7 +1422,10 @@ if page == "📊 Configuration":
                     'Available_Week4': avail_df['Available_Week4'].sum()
                 }])
                 avail_df = pd.concat([avail_df, total_row], ignore_index=True)
-                st.dataframe(avail_df, use_container_width=True)
+                st.dataframe(avail_df, width=TABLE_WIDTH, column_config={
+                    'Available_Week3': st.column_config.NumberColumn(format='%d'),
+                    'Available_Week4': st.column_config.NumberColumn(format='%d')
+                })
         else:
             st.warning("No schedule records found")
         
@@ -1004,8 +1433,8 @@ if page == "📊 Configuration":
         
         # Add/Update Schedule
         with st.expander("➕ Add/Update Schedule (添加/更新调度)", expanded=False):
-            warehouses = st.session_state.warehouses['Name'].tolist()
-            skus = st.session_state.sku['sku_code'].tolist()
+            warehouses = wh_df['Name'].tolist()
+            skus = sku_df['sku_code'].tolist()
             
             if warehouses and skus:
                 with st.form("add_schedule_form"):
@@ -1023,9 +1452,9 @@ if page == "📊 Configuration":
                     submit_sch = st.form_submit_button("💾 Save Schedule", type="primary")
                     
                     if submit_sch:
-                        db.save_warehouse_schedule(sch_wh, sch_sku, in_w3, in_w4, out_w1, out_w2)
-                        db.update_warehouse_inventory(sch_wh, sch_sku, current_inv, 0)
-                        st.session_state.warehouse_schedule = db.get_warehouse_schedule()
+                        db.save_warehouse_schedule(sch_wh, sch_sku, in_w3, in_w4, out_w1, out_w2, inventory=(current_inv, 0))
+                        db.reload_table('warehouse_schedule')
+                        db.reload_table('warehouse_inventory')
                         st.success("Schedule and inventory updated!")
                         st.rerun()
             else:
@@ -1033,21 +1462,23 @@ if page == "📊 Configuration":
 
     # ======== Original tab3 -> now tab6 ========
     with tab6:
+        demand_df = st.session_state.demand_forecast
+        demand_w3, demand_w4 = frame_stats('demand_totals', demand_df, _demand_totals)
+        
         st.subheader("Demand Forecast (需求预测)")
         
         # Display current demand
         st.markdown("**Current Demand Forecast (当前需求预测)**")
         
         # Add summary row to demand display
-        demand_display = st.session_state.demand_forecast.copy()
-        summary_row = pd.DataFrame({
-            'Product': ['** TOTAL **'],
-            'Channel': ['All Channels'],
-            'State': ['All States'],
-            'Demand_Week3': [demand_display['Demand_Week3'].sum()],
-            'Demand_Week4': [demand_display['Demand_Week4'].sum()]
+        demand_display = demand_df
+        demand_with_summary = with_summary_row(demand_display, {
+            'Product': '** TOTAL **',
+            'Channel': 'All Channels',
+            'State': 'All States',
+            'Demand_Week3': demand_w3,
+            'Demand_Week4': demand_w4
         })
-        demand_with_summary = pd.concat([demand_display, summary_row], ignore_index=True)
         
         st.dataframe(demand_with_summary, use_container_width=True, hide_index=True)
         
@@ -1057,7 +1488,7 @@ if page == "📊 Configuration":
             st.info("💡 Enter demand for Week 3 and Week 4 only (仅输入第3周和第4周的需求)")
             
             edited_demand = st.data_editor(
-                st.session_state.demand_forecast,
+                demand_df,
                 num_rows="dynamic",
                 use_container_width=True,
                 column_config={
@@ -1072,6 +1503,7 @@ if page == "📊 Configuration":
             col1, col2 = st.columns(2)
             with col1:
                 if st.button("💾 Save Demand (保存需求)", type="primary", use_container_width=True):
+                    db.bulk_save_demand(edited_demand)
                     st.session_state.demand_forecast = edited_demand
                     st.session_state.success_msg = "✅ Demand forecast saved! (需求预测已保存!)"
                     st.rerun()
@@ -1092,10 +1524,10 @@ if page == "📊 Configuration":
         st.markdown("---")
         col1, col2 = st.columns(2)
         with col1:
-            total_w3 = st.session_state.demand_forecast['Demand_Week3'].sum()
+            total_w3 = demand_w3
             st.metric("Total Week 3 Demand (第3周总需求)", f"{total_w3:,}")
         with col2:
-            total_w4 = st.session_state.demand_forecast['Demand_Week4'].sum()
+            total_w4 = demand_w4
             st.metric("Total Week 4 Demand (第4周总需求)", f"{total_w4:,}")
 
     # ======== Legacy Settings - keep for backward compatibility ========
@@ -1129,20 +1561,27 @@ if page == "📊 Configuration":
             st.session_state.tms_shipping_rate = tms_rate
         
         if st.button("Save Legacy Rates"):
-            db.save_setting('market_shipping_rate', str(market_rate))
-            db.save_setting('tms_shipping_rate', str(tms_rate))
+            db.save_settings({'market_shipping_rate': str(market_rate), 'tms_shipping_rate': str(tms_rate)})
             st.success("Legacy rates saved!")
     
     # ======== Customer Plan Tab ========
     with tab7:
+        sku_df = st.session_state.sku
+        wh_df = st.session_state.warehouses
+        demand_df = st.session_state.demand_forecast
+        
         st.subheader("Customer Current Plan Configuration (客户当前方案配置)")
         
         # Load customer settings
         if 'customer_settings' not in st.session_state:
-            st.session_state.customer_settings = db.get_customer_settings()
+            db.reload_table('customer_settings')
+        
+        # Load vehicles
+        if 'vehicles' not in st.session_state:
+            db.reload_table('vehicles')
         
         carriers_df = st.session_state.carriers
-        vehicles_df = st.session_state.get('vehicles', pd.DataFrame())
+        vehicles_df = st.session_state.vehicles
         
         # Prepare carrier options
         customer_carrier_options = {}
@@ -1151,9 +1590,11 @@ if page == "📊 Configuration":
         selected_tms_carrier = None
         
         if not carriers_df.empty:
-            customer_carrier_options = {f"{row['name']} ({row['mode']})": row['id'] for _, row in carriers_df.iterrows()}
+            carrier_labels = carriers_df['name'].astype(str) + ' (' + carriers_df['mode'].astype(str) + ')'
+            customer_carrier_options = dict(zip(carrier_labels.tolist(), carriers_df['id'].tolist()))
             # TMS carrier dropdown - only show TMS carriers
-            tms_carrier_options = {f"{row['name']} ({row['mode']})": row['id'] for _, row in carriers_df.iterrows() if row['name'] == 'TMS'}
+            is_tms = carriers_df['name'] == 'TMS'
+            tms_carrier_options = dict(zip(carrier_labels[is_tms].tolist(), carriers_df.loc[is_tms, 'id'].tolist()))
         
         # ======== Section 1: Carrier Selection ========
         st.markdown("### 🚚 Carrier Selection (选择承运商)")
@@ -1206,7 +1647,8 @@ if page == "📊 Configuration":
                 customer_carrier_id = customer_carrier_options.get(selected_customer_carrier)
                 tms_carrier_id = tms_carrier_options.get(selected_tms_carrier)
                 db.save_customer_settings(customer_carrier_id, tms_carrier_id)
-                st.session_state.customer_settings = db.get_customer_settings()
+                compute_rate_table.clear()
+                db.reload_table('customer_settings')
                 st.success("Carriers saved!")
                 st.rerun()
         
@@ -1216,7 +1658,7 @@ if page == "📊 Configuration":
         st.markdown("### 🚛 Vehicle Selection (选择车辆)")
         
         if not vehicles_df.empty:
-            vehicle_options = {row['name']: row['id'] for _, row in vehicles_df.iterrows()}
+            vehicle_options = dict(zip(vehicles_df['name'].tolist(), vehicles_df['id'].tolist()))
             selected_vehicle = st.selectbox(
                 "Select Trailer Size",
                 options=list(vehicle_options.keys()),
@@ -1234,57 +1676,23 @@ if page == "📊 Configuration":
         st.markdown("### 💰 Calculated Unit Shipping Rates (计算的单位运费)")
         
         # Calculate shipping rates for each warehouse-DC pair
-        if not customer_carrier_options or not tms_carrier_options or st.session_state.sku.empty or st.session_state.warehouses.empty:
+        if not customer_carrier_options or not tms_carrier_options or sku_df.empty or wh_df.empty:
             st.info("Please configure carriers, SKUs, and warehouses first")
         else:
             customer_carrier_id = customer_carrier_options.get(selected_customer_carrier)
             tms_carrier_id = tms_carrier_options.get(selected_tms_carrier)
             
-            distance_matrix = calculate_distance_matrix()
-            skus_list = st.session_state.sku['sku_code'].tolist()
-            
-            rate_calculation = []
-            for _, dist_row in distance_matrix.iterrows():
-                for sku in skus_list:
-                    # Customer rate
-                    cust_rate, cust_max_units, _ = db.calculate_unit_shipping_rate(sku, dist_row['Distance_Miles'], customer_carrier_id, selected_vehicle_id)
-                    # TMS rate
-                    tms_rate, tms_max_units, _ = db.calculate_unit_shipping_rate(sku, dist_row['Distance_Miles'], tms_carrier_id, selected_vehicle_id)
-                    
-                    rate_calculation.append({
-                        'Warehouse': dist_row['Warehouse'],
-                        'DC': f"{dist_row['DC_Channel']}-{dist_row['DC_State']}",
-                        'SKU': sku,
-                        'Distance': round(dist_row['Distance_Miles'], 0),
-                        f'Max Units / {selected_vehicle}': tms_max_units,
-                        'Customer Rate / ea': round(cust_rate, 4),
-                        'TMS Rate / ea': round(tms_rate, 4),
-                        'Savings / ea': round(cust_rate - tms_rate, 4)
-                    })
-            
-            rate_df = pd.DataFrame(rate_calculation)
-            if not rate_df.empty:
-                st.dataframe(rate_df, use_container_width=True)
-                
-                # Summary
-                avg_cust = rate_df['Customer Rate / ea'].mean()
-                avg_tms = rate_df['TMS Rate / ea'].mean()
-                avg_savings = rate_df['Savings / ea'].mean()
-                
-                col1, col2, col3 = st.columns(3)
-                with col1:
-                    st.metric("Avg Customer Rate", f"${avg_cust:.4f}")
-                with col2:
-                    st.metric("Avg TMS Rate", f"${avg_tms:.4f}")
-                with col3:
-                    st.metric("Avg Savings", f"${avg_savings:.4f}")
+            render_rate_table(
+                customer_carrier_id, tms_carrier_id, selected_vehicle_id, selected_vehicle,
+                tuple(sku_df['sku_code'].tolist())
+            )
         
         st.markdown("---")
         
         # ======== Section 2: Warehouse Selection ========
         st.markdown("### 📦 Select Customer Warehouses (选择客户仓库)")
         
-        all_warehouses = st.session_state.warehouses['Name'].tolist()
+        all_warehouses = wh_df['Name'].tolist()
         
         # Get current saved selection, defaulting to all if not set
         current_selection = st.session_state.get('customer_selected_warehouses', all_warehouses)
@@ -1311,38 +1719,12 @@ if page == "📊 Configuration":
                 st.error("⚠️ Please select at least one warehouse first. (请先选择至少一个仓库)")
             else:
                 # Auto-allocate logic (Nearest Neighbor)
-                demand = st.session_state.demand_forecast
-                distance_matrix = calculate_distance_matrix()
-                rate = st.session_state.market_shipping_rate
-                shipping_costs = calculate_shipping_costs(distance_matrix, rate)
-                
-                new_plan_rows = []
+                demand = demand_df
+                shipping_costs = get_shipping_costs('market')
                 
-                for _, d in demand.iterrows():
-                    channel = d['Channel']
-                    state = d['State']
-                    product = d['Product']
-                    
-                    # Find nearest selected warehouse
-                    relevant_costs = shipping_costs[
-                        (shipping_costs['DC_Channel'] == channel) & 
-                        (shipping_costs['DC_State'] == state) &
-                        (shipping_costs['Warehouse'].isin(selected_plan_whs))
-                    ].sort_values('Distance_Miles')
-                    
-                    if not relevant_costs.empty:
-                        nearest_wh = relevant_costs.iloc[0]['Warehouse']
-                        
-                        new_plan_rows.append({
-                            'Product': product,
-                            'Warehouse': nearest_wh,
-                            'Channel': channel,
-                            'State': state,
-                            'Allocated_Units_Week3': d['Demand_Week3'],
-                            'Allocated_Units_Week4': d['Demand_Week4']
-                        })
-                
-                st.session_state.customer_allocation_plan = pd.DataFrame(new_plan_rows)
+                st.session_state.customer_allocation_plan = build_nearest_plan(
+                    demand, shipping_costs, tuple(selected_plan_whs)
+                )
                 st.session_state.success_msg = f"✅ Plan generated using {len(selected_plan_whs)} warehouses. (方案已生成!)"
                 st.rerun()
         
@@ -1373,54 +1755,33 @@ if page == "📊 Configuration":
         
         # Save button for manual edits
         if st.button("💾 Save Changes (保存更改)", type="primary"):
-            st.session_state.customer_allocation_plan = edited_plan
-            st.session_state.success_msg = "✅ Allocation plan saved! (分配方案已保存!)"
-            st.rerun()
+            if frame_fingerprint(edited_plan) == frame_fingerprint(st.session_state.customer_allocation_plan):
+                # Nothing edited: keep the stored plan (and every cache keyed on it) as is
+                st.info("No changes to save. (没有需要保存的更改)")
+            else:
+                # The editor's output is already on screen and validated below, so no rerun is needed
+                st.session_state.customer_allocation_plan = edited_plan
+                st.success("✅ Allocation plan saved! (分配方案已保存!)")
         
         # 4. Validation Display
         st.markdown("---")
         st.markdown("**3. Validation (验证)**")
         
-        demand = st.session_state.demand_forecast
-        plan = st.session_state.customer_allocation_plan
-        
-        validation_data = []
-        all_valid = True
-        
-        for _, d in demand.iterrows():
-            channel = d['Channel']
-            state = d['State']
-            
-            # Filter plan for this DC
-            dc_plan = plan[
-                (plan['Channel'] == channel) & 
-                (plan['State'] == state)
-            ]
-            
-            for week in [3, 4]:
-                req = d[f'Demand_Week{week}']
-                alloc = dc_plan[f'Allocated_Units_Week{week}'].sum()
-                
-                status = "✅ OK"
-                if alloc < req:
-                    status = f"❌ Low ({alloc-req:+.0f})"
-                    all_valid = False
-                elif alloc > req:
-                    status = f"⚠️ High ({alloc-req:+.0f})"
-                
-                validation_data.append({
-                    'DC': f"{channel}-{state}",
-                    'Week': f"Week {week}",
-                    'Demand': req,
-                    'Allocated': alloc,
-                    'Status': status
-                })
+        # Validate what the editor currently shows, saved or not (校验编辑器当前内容)
+        demand = demand_df
+        plan = edited_plan
         
-        val_df = pd.DataFrame(validation_data)
+        val_df = validate_plan(demand, plan)
+        all_valid = not val_df['Status'].str.startswith('❌').any()
         
-        # Display validation table with styling
+        # Display validation table with styling; colours are worked out once for the whole column
+        status_colors = np.select(
+            [val_df['Status'].str.startswith('❌'), val_df['Status'].str.startswith('⚠️')],
+            ['color: red', 'color: orange'],
+            default='color: green'
+        )
         st.dataframe(
-            val_df.style.map(lambda x: 'color: red' if '❌' in str(x) else ('color: orange' if '⚠️' in str(x) else 'color: green'), subset=['Status']),
+            val_df.style.apply(lambda col: status_colors, subset=['Status']),
             use_container_width=True,
             hide_index=True
         )
@@ -1447,9 +1808,10 @@ elif page == "🤖 Run Scenarios":
             with st.spinner("Calculating customer cost..."):
                 results = calculate_customer_cost_multi_week()
                 st.session_state.customer_results = results
+                st.session_state.customer_total = results_total(results)
+                st.session_state.customer_stats = results_stats(results)
                 
-                total = sum(cost for _, cost in results.values())
-                st.success(f"✅ Customer Total Cost: ${total:,.2f}")
+                st.success(f"✅ Customer Total Cost: ${st.session_state.customer_total:,.2f}")
                 
     with col2:
         st.subheader("2. Smart Optimization")
@@ -1459,9 +1821,10 @@ elif page == "🤖 Run Scenarios":
             with st.spinner("Optimizing allocation..."):
                 results = optimize_allocation_multi_week()
                 st.session_state.smart_results = results
+                st.session_state.smart_total = results_total(results)
+                st.session_state.smart_stats = results_stats(results)
                 
-                total = sum(cost for _, cost in results.values() if cost is not None)
-                st.success(f"✅ Smart Solution Total Cost: ${total:,.2f}")
+                st.success(f"✅ Smart Solution Total Cost: ${st.session_state.smart_total:,.2f}")
     
     st.markdown("---")
     
@@ -1474,8 +1837,7 @@ elif page == "🤖 Run Scenarios":
         with c1:
             if 'customer_results' in st.session_state:
                 st.markdown("**Customer Plan Results**")
-                cust_total = sum(cost for _, cost in st.session_state.customer_results.values())
-                st.info(f"Total Cost: **${cust_total:,.2f}**")
+                st.info(f"Total Cost: **${st.session_state.customer_total:,.2f}**")
                 
                 # Show brief breakdown
                 for week in [3, 4]:
@@ -1487,8 +1849,7 @@ elif page == "🤖 Run Scenarios":
         with c2:
             if 'smart_results' in st.session_state:
                 st.markdown("**Smart Optimization Results**")
-                smart_total = sum(cost for _, cost in st.session_state.smart_results.values() if cost is not None)
-                st.success(f"Total Cost: **${smart_total:,.2f}**")
+                st.success(f"Total Cost: **${st.session_state.smart_total:,.2f}**")
                 
                 # Show brief breakdown
                 for week in [3, 4]:
@@ -1501,101 +1862,12 @@ elif page == "🤖 Run Scenarios":
             st.markdown("---")
             st.info("👉 Go to **Cost Comparison** page for detailed analysis.")
 
-    # Display Customer Allocation Details
+    # Display Customer and Smart Allocation Details (客户与智能分配详情)
     if 'customer_results' in st.session_state:
-        st.markdown("---")
-        st.subheader("📋 Customer Allocation Details")
-        
-        tab1, tab2 = st.tabs(["Week 3 Results (第3周结果)", "Week 4 Results (第4周结果)"])
-        
-        for idx, week in enumerate([3, 4]):
-            with [tab1, tab2][idx]:
-                allocation_df, total_cost = st.session_state.customer_results.get(week, (None, None))
-                
-                if allocation_df is not None:
-                    st.subheader(f"Week {week} Customer Allocation (第{week}周客户分配)")
-                    
-                    col1, col2 = st.columns([2, 1])
-                    with col1:
-                        st.metric("Total Cost (总成本)", f"${total_cost:,.2f}", 
-                                 help="Using Market rates. Cost reduced by available inventory. (使用市场费率，已扣除可用库存)")
-                    with col2:
-                        st.metric("Total Units (总数量)", f"{allocation_df['Allocated_Units'].sum():,.0f}")
-                    
-                    st.markdown("**Allocation Details (分配详情)**")
-                    display_alloc = allocation_df[['Product', 'Warehouse', 'Channel', 'State', 'Allocated_Units', 'Allocated_Shipped', 'Cost_Per_Unit', 'Total_Cost']].copy()
-                    display_alloc['Allocated_Units'] = display_alloc['Allocated_Units'].round(0)
-                    display_alloc['Allocated_Shipped'] = display_alloc['Allocated_Shipped'].round(0)
-                    display_alloc['Cost_Per_Unit'] = display_alloc['Cost_Per_Unit'].round(3)
-                    display_alloc['Total_Cost'] = display_alloc['Total_Cost'].round(2)
-                    st.dataframe(display_alloc, use_container_width=True, hide_index=True)
-                    
-                    # By warehouse summary
-                    st.markdown("**By Warehouse (按仓库汇总)**")
-                    wh_summary = allocation_df.groupby('Warehouse').agg({
-                        'Allocated_Units': 'sum',
-                        'Total_Cost': 'sum'
-                    }).reset_index()
-                    wh_summary.columns = ['Warehouse', 'Total Units', 'Total Cost ($)']
-                    
-                    col1, col2 = st.columns(2)
-                    with col1:
-                        st.dataframe(wh_summary, use_container_width=True, hide_index=True)
-                    with col2:
-                        fig = px.pie(wh_summary, values='Total Units', names='Warehouse',
-                                    title=f'Week {week} Customer Allocation Distribution')
-                        fig.update_layout(template='plotly_white', margin=dict(t=40, b=20, l=20, r=20))
-                        st.plotly_chart(fig, use_container_width=True)
-                else:
-                    st.warning(f"⚠️ No results for Week {week}. Calculate customer cost first. (第{week}周无结果，请先计算客户成本)")
-
-    # Display Smart Allocation Details (Moved from old Smart Suggestion page)
+        render_allocation_details(st.session_state.customer_results, 'customer')
+    
     if 'smart_results' in st.session_state:
-        st.markdown("---")
-        st.subheader("📋 Smart Allocation Details")
-        
-        tab1, tab2 = st.tabs(["Week 3 Results (第3周结果)", "Week 4 Results (第4周结果)"])
-        
-        for idx, week in enumerate([3, 4]):
-            with [tab1, tab2][idx]:
-                allocation_df, total_cost = st.session_state.smart_results.get(week, (None, None))
-                
-                if allocation_df is not None:
-                    st.subheader(f"Week {week} Smart Allocation (第{week}周智能分配)")
-                    
-                    col1, col2 = st.columns([2, 1])
-                    with col1:
-                        st.metric("Total Cost (总成本)", f"${total_cost:,.2f}", 
-                                 help="Using TMS rates. Cost reduced by available inventory. (使用TMS费率，已扣除可用库存)")
-                    with col2:
-                        st.metric("Total Units (总数量)", f"{allocation_df['Allocated_Units'].sum():,.0f}")
-                    
-                    st.markdown("**Allocation Details (分配详情)**")
-                    display_alloc = allocation_df[['Product', 'Warehouse', 'Channel', 'State', 'Allocated_Units', 'Allocated_Shipped', 'Cost_Per_Unit', 'Total_Cost']].copy()
-                    display_alloc['Allocated_Units'] = display_alloc['Allocated_Units'].round(0)
-                    display_alloc['Allocated_Shipped'] = display_alloc['Allocated_Shipped'].round(0)
-                    display_alloc['Cost_Per_Unit'] = display_alloc['Cost_Per_Unit'].round(3)
-                    display_alloc['Total_Cost'] = display_alloc['Total_Cost'].round(2)
-                    st.dataframe(display_alloc, use_container_width=True, hide_index=True)
-                    
-                    # By warehouse summary
-                    st.markdown("**By Warehouse (按仓库汇总)**")
-                    wh_summary = allocation_df.groupby('Warehouse').agg({
-                        'Allocated_Units': 'sum',
-                        'Total_Cost': 'sum'
-                    }).reset_index()
-                    wh_summary.columns = ['Warehouse', 'Total Units', 'Total Cost ($)']
-                    
-                    col1, col2 = st.columns(2)
-                    with col1:
-                        st.dataframe(wh_summary, use_container_width=True, hide_index=True)
-                    with col2:
-                        fig = px.pie(wh_summary, values='Total Units', names='Warehouse',
-                                    title=f'Week {week} Allocation Distribution')
-                        fig.update_layout(template='plotly_white', margin=dict(t=40, b=20, l=20, r=20))
-                        st.plotly_chart(fig, use_container_width=True)
-                else:
-                    st.warning(f"⚠️ No results for Week {week}. Run optimization first. (第{week}周无结果，请先运行优化)")
+        render_allocation_details(st.session_state.smart_results, 'smart')
 
 
 # Cost Comparison Page
@@ -1613,9 +1885,9 @@ elif page == "📈 Cost Comparison":
         st.markdown("---")
         st.markdown("### 💰 Cost Comparison Results (成本对比结果)")
         
-        # Calculate totals
-        customer_total = sum(cost for _, cost in st.session_state.customer_results.values())
-        smart_total = sum(cost for _, cost in st.session_state.smart_results.values() if cost is not None)
+        # Totals are stored when the scenarios are run (总成本在运行场景时已计算)
+        customer_total = st.session_state.customer_total
+        smart_total = st.session_state.smart_total
         
         savings = customer_total - smart_total
         savings_pct = (savings / customer_total * 100) if customer_total > 0 else 0
@@ -1650,46 +1922,32 @@ elif page == "📈 Cost Comparison":
         st.markdown("---")
         st.markdown("### 📊 Week-by-Week Summary (逐周汇总)")
         
-        comparison_data = []
-        for week in [3, 4]:
-            _, cust_cost = st.session_state.customer_results.get(week, (None, 0))
-            _, smart_cost = st.session_state.smart_results.get(week, (None, 0))
-            
-            comparison_data.append({
-                'Week': f'Week {week}',
-                'Customer Current ($)': cust_cost,
-                'Smart Solution ($)': smart_cost,
-                'Savings ($)': cust_cost - smart_cost,
-                'Savings %': ((cust_cost - smart_cost) / cust_cost * 100) if cust_cost > 0 else 0
-            })
-        
-        comparison_df = pd.DataFrame(comparison_data)
+        weeks = (3, 4)
+        cust_costs = np.array([st.session_state.customer_results.get(week, (None, 0))[1] or 0 for week in weeks], dtype=float)
+        smart_costs = np.array([st.session_state.smart_results.get(week, (None, 0))[1] or 0 for week in weeks], dtype=float)
+        week_savings = cust_costs - smart_costs
+        
+        comparison_df = pd.DataFrame({
+            'Week': [f'Week {week}' for week in weeks],
+            'Customer Current ($)': cust_costs,
+            'Smart Solution ($)': smart_costs,
+            'Savings ($)': week_savings,
+            'Savings %': np.divide(week_savings, cust_costs, out=np.zeros_like(week_savings), where=cust_costs > 0) * 100
+        })
         st.dataframe(comparison_df, use_container_width=True, hide_index=True)
         
         # Visual comparison
-        fig = go.Figure()
-        fig.add_trace(go.Bar(name='Customer Current', x=['Week 3', 'Week 4'], 
-                            y=[comparison_data[0]['Customer Current ($)'], comparison_data[1]['Customer Current ($)']],
-                            marker_color='#FF6B6B'))
-        fig.add_trace(go.Bar(name='Smart Solution', x=['Week 3', 'Week 4'],
-                            y=[comparison_data[0]['Smart Solution ($)'], comparison_data[1]['Smart Solution ($)']],
-                            marker_color='#4ECDC4'))
-        fig.update_layout(title='Cost Comparison by Week (按周成本对比)', 
-                         barmode='group',
-                         yaxis_title='Cost ($)',
-                         height=400,
-                         template='plotly_white',
-                         font=dict(family="Inter, sans-serif"))
+        fig = weekly_cost_bar(tuple(cust_costs.tolist()), tuple(smart_costs.tolist()))
         st.plotly_chart(fig, use_container_width=True)
         
         # DETAILED COMPARISON BY WEEK
         st.markdown("---")
         st.markdown("### 📋 Detailed Comparison by Week (详细对比)")
         
-        tab1, tab2 = st.tabs(["Week 3 Details (第3周明细)", "Week 4 Details (第4周明细)"])
+        week_tabs = st.tabs(["Week 3 Details (第3周明细)", "Week 4 Details (第4周明细)"])
         
-        for tab_idx, week in enumerate([3, 4]):
-            with [tab1, tab2][tab_idx]:
+        for tab, week in zip(week_tabs, (3, 4)):
+            with tab:
                 st.subheader(f"Week {week} Detailed Comparison (第{week}周详细对比)")
                 
                 customer_df, cust_cost = st.session_state.customer_results.get(week, (None, 0))
@@ -1703,26 +1961,12 @@ elif page == "📈 Cost Comparison":
                         st.markdown("**🏢 Customer Current Plan (客户当前方案)**")
                         st.info(f"Total Cost: ${cust_cost:,.2f} | Market Rate: ${st.session_state.market_shipping_rate:.3f}/unit/100mi")
                         
-                        # Prepare customer data for display
-                        cust_display = customer_df[['Product', 'Warehouse', 'Channel', 'State', 'Allocated_Units', 'Allocated_Shipped', 'Cost_Per_Unit', 'Distance_Miles', 'Total_Cost']].copy()
-                        cust_display['Allocated_Units'] = cust_display['Allocated_Units'].round(0).astype(int)
-                        cust_display['Allocated_Shipped'] = cust_display['Allocated_Shipped'].round(0).astype(int)
-                        cust_display['Cost_Per_Unit'] = cust_display['Cost_Per_Unit'].apply(lambda x: f"${x:.4f}")
-                        cust_display['Distance_Miles'] = cust_display['Distance_Miles'].round(1)
-                        cust_display['Total_Cost'] = cust_display['Total_Cost'].apply(lambda x: f"${x:,.2f}")
-                        
-                        cust_display.columns = ['Product', 'Warehouse', 'Channel', 'State', 'Units', 'Shipped', 'Rate ($/unit)', 'Distance (mi)', 'Cost']
-                        
-                        st.dataframe(cust_display, use_container_width=True, hide_index=True)
+                        st.dataframe(customer_df, column_order=DETAIL_COLUMNS, column_config=DETAIL_COLUMN_CONFIG,
+                                     use_container_width=True, hide_index=True)
                         
                         # Customer summary by warehouse
-                        cust_wh_summary = customer_df.groupby('Warehouse').agg({
-                            'Allocated_Units': 'sum',
-                            'Total_Cost': 'sum'
-                        }).reset_index()
-                        cust_wh_summary.columns = ['Warehouse', 'Total Units', 'Total Cost ($)']
+                        cust_wh_summary = warehouse_summary(customer_df).round({'Total Cost ($)': 2})
                         cust_wh_summary['Total Units'] = cust_wh_summary['Total Units'].round(0).astype(int)
-                        cust_wh_summary['Total Cost ($)'] = cust_wh_summary['Total Cost ($)'].round(2)
                         
                         st.markdown("**Summary by Warehouse (按仓库汇总)**")
                         st.dataframe(cust_wh_summary, use_container_width=True, hide_index=True)
@@ -1731,26 +1975,12 @@ elif page == "📈 Cost Comparison":
                         st.markdown("**💡 Smart Suggestion (智能建议)**")
                         st.info(f"Total Cost: ${smart_cost:,.2f} | TMS Rate: ${st.session_state.tms_shipping_rate:.3f}/unit/100mi")
                         
-                        # Prepare smart data for display
-                        smart_display = smart_df[['Product', 'Warehouse', 'Channel', 'State', 'Allocated_Units', 'Allocated_Shipped', 'Cost_Per_Unit', 'Distance_Miles', 'Total_Cost']].copy()
-                        smart_display['Allocated_Units'] = smart_display['Allocated_Units'].round(0).astype(int)
-                        smart_display['Allocated_Shipped'] = smart_display['Allocated_Shipped'].round(0).astype(int)
-                        smart_display['Cost_Per_Unit'] = smart_display['Cost_Per_Unit'].apply(lambda x: f"${x:.4f}")
-                        smart_display['Distance_Miles'] = smart_display['Distance_Miles'].round(1)
-                        smart_display['Total_Cost'] = smart_display['Total_Cost'].apply(lambda x: f"${x:,.2f}")
-                        
-                        smart_display.columns = ['Product', 'Warehouse', 'Channel', 'State', 'Units', 'Shipped', 'Rate ($/unit)', 'Distance (mi)', 'Cost']
-                        
-                        st.dataframe(smart_display, use_container_width=True, hide_index=True)
+                        st.dataframe(smart_df, column_order=DETAIL_COLUMNS, column_config=DETAIL_COLUMN_CONFIG,
+                                     use_container_width=True, hide_index=True)
                         
                         # Smart summary by warehouse
-                        smart_wh_summary = smart_df.groupby('Warehouse').agg({
-                            'Allocated_Units': 'sum',
-                            'Total_Cost': 'sum'
-                        }).reset_index()
-                        smart_wh_summary.columns = ['Warehouse', 'Total Units', 'Total Cost ($)']
+                        smart_wh_summary = warehouse_summary(smart_df).round({'Total Cost ($)': 2})
                         smart_wh_summary['Total Units'] = smart_wh_summary['Total Units'].round(0).astype(int)
-                        smart_wh_summary['Total Cost ($)'] = smart_wh_summary['Total Cost ($)'].round(2)
                         
                         st.markdown("**Summary by Warehouse (按仓库汇总)**")
                         st.dataframe(smart_wh_summary, use_container_width=True, hide_index=True)
@@ -1774,21 +2004,14 @@ elif page == "📈 Cost Comparison":
                     # Compare warehouse usage
                     st.markdown("**Warehouse Usage Comparison (仓库使用对比)**")
                     
-                    # Merge customer and smart warehouse summaries
-                    cust_wh_summary['Plan'] = 'Customer'
-                    smart_wh_summary['Plan'] = 'Smart'
-                    
+                    # Merge customer and smart warehouse summaries without mutating the displayed tables
+                    # 合并客户与智能仓库汇总，不修改已显示的表格
                     combined = pd.concat([
-                        cust_wh_summary[['Warehouse', 'Total Units', 'Plan']],
-                        smart_wh_summary[['Warehouse', 'Total Units', 'Plan']]
-                    ])
+                        cust_wh_summary[['Warehouse', 'Total Units']].assign(Plan='Customer'),
+                        smart_wh_summary[['Warehouse', 'Total Units']].assign(Plan='Smart')
+                    ], ignore_index=True)
                     
-                    fig_wh = px.bar(combined, x='Warehouse', y='Total Units', color='Plan',
-                                   barmode='group',
-                                   title=f'Week {week} - Warehouse Usage Comparison',
-                                   color_discrete_map={'Customer': '#EF4444', 'Smart': '#10B981'})
-                    fig_wh.update_layout(template='plotly_white', font=dict(family="Inter, sans-serif"))
-                    st.plotly_chart(fig_wh, use_container_width=True)
+                    st.plotly_chart(warehouse_usage_bar(combined, week), use_container_width=True)
                     
                     # Key Insights
                     st.markdown("**💡 Key Insights (关键洞察)**")
@@ -1796,8 +2019,10 @@ elif page == "📈 Cost Comparison":
                     insights = []
                     
                     # Compare warehouse counts
-                    cust_wh_count = len(cust_wh_summary)
-                    smart_wh_count = len(smart_wh_summary)
+                    cust_stats = st.session_state.customer_stats[week]
+                    smart_stats = st.session_state.smart_stats[week]
+                    cust_wh_count = cust_stats['n_wh']
+                    smart_wh_count = smart_stats['n_wh']
                     
                     if smart_wh_count < cust_wh_count:
                         insights.append(f"✅ Smart solution uses **{smart_wh_count} warehouses** vs customer's {cust_wh_count}, improving efficiency (智能方案使用更少仓库，提升效率)")
@@ -1809,8 +2034,8 @@ elif page == "📈 Cost Comparison":
                         insights.append(f"💰 TMS rate is **${rate_diff:.3f} ({(rate_diff/st.session_state.market_shipping_rate*100):.1f}%)** lower than market rate (TMS费率优势)")
                     
                     # Distance optimization
-                    cust_avg_dist = customer_df['Distance_Miles'].mean()
-                    smart_avg_dist = smart_df['Distance_Miles'].mean()
+                    cust_avg_dist = cust_stats['avg_dist']
+                    smart_avg_dist = smart_stats['avg_dist']
                     dist_diff = cust_avg_dist - smart_avg_dist
                     
                     if dist_diff > 0:
@@ -1846,31 +2071,48 @@ elif page == "📁 Data Management":
             'customer_allocation_plan': st.session_state.customer_allocation_plan.to_dict('records')
         }
         
-        json_str = json.dumps(config, indent=2)
         st.download_button(
             label="⬇️ Download Configuration File (下载配置文件)",
-            data=json_str,
+            data=config_to_json(config),
             file_name="warehouse_config.json",
             mime="application/json"
         )
+        
+        if PARQUET_AVAILABLE:
+            st.download_button(
+                label="⬇️ Download as Parquet Bundle (下载Parquet压缩包)",
+                data=config_to_parquet_zip(
+                    {name: st.session_state[name] for name in CONFIG_FRAMES},
+                    {key: config[key] for key in ('market_shipping_rate', 'tms_shipping_rate')}
+                ),
+                file_name="warehouse_config.zip",
+                mime="application/zip",
+                help="Column types are kept, and large configurations load much faster than JSON. (保留列类型，大数据量导入更快)"
+            )
     
     # Import
     st.markdown("---")
     st.subheader("📤 Import Configuration (导入配置)")
     
-    uploaded_config = st.file_uploader("Upload Configuration JSON (上传配置JSON)", type=['json'])
+    uploaded_config = st.file_uploader(
+        "Upload Configuration JSON or Parquet Bundle (上传配置JSON或Parquet压缩包)",
+        type=['json', 'zip'] if PARQUET_AVAILABLE else ['json']
+    )
     if uploaded_config:
         try:
-            config = json.load(uploaded_config)
+            if uploaded_config.name.endswith('.zip'):
+                config = config_from_parquet_zip(uploaded_config)
+            else:
+                config = json.load(uploaded_config)
             
-            st.session_state.warehouses = pd.DataFrame(config['warehouses'])
-            st.session_state.distribution_centers = pd.DataFrame(config['distribution_centers'])
-            st.session_state.demand_forecast = pd.DataFrame(config['demand_forecast'])
+            st.session_state.warehouses = db.with_string_keys(pd.DataFrame(config['warehouses']), db.WAREHOUSE_TEXT_COLUMNS)
+            st.session_state.distribution_centers = db.with_string_keys(pd.DataFrame(config['distribution_centers']))
+            st.session_state.demand_forecast = db.with_string_keys(pd.DataFrame(config['demand_forecast']))
             st.session_state.market_shipping_rate = config.get('market_shipping_rate', 0.18)
             st.session_state.tms_shipping_rate = config.get('tms_shipping_rate', 0.12)
             
             if 'customer_allocation_plan' in config:
-                st.session_state.customer_allocation_plan = pd.DataFrame(config['customer_allocation_plan'])
+                st.session_state.customer_allocation_plan = db.with_string_keys(pd.DataFrame(config['customer_allocation_plan']))
             
             st.success("✅ Configuration imported successfully! (配置导入成功!)")
             st.rerun()
@@ -1,17 +1,174 @@
 import sqlite3
+import contextlib
+import functools
+import threading
+import numpy as np
 import pandas as pd
 import os
 from datetime import datetime
+from typing import NamedTuple
 import streamlit as st
 
+try:
+    import pyarrow  # noqa: F401  可选依赖: 键列使用 Arrow 字符串
+    KEY_STRING_DTYPE = 'string[pyarrow]'
+except ImportError:
+    KEY_STRING_DTYPE = None
+
 DB_FILE = "warehouse_v5.db"
+# pandas >= 3 始终启用 copy-on-write: 浅拷贝即可隔离修改, 只有被修改的列才真正复制
+PANDAS_COPY_ON_WRITE = int(pd.__version__.split('.')[0]) >= 3
+KEY_COLUMNS = ('Product', 'Warehouse', 'Channel', 'State')
+# 其他表的文本列, 同样可用 Arrow 字符串 (比 object 列省内存, 仓库名与计划的 Warehouse 键类型一致)
+WAREHOUSE_TEXT_COLUMNS = ('Name', 'Address')
+CUSTOMER_SETTINGS_TEXT_COLUMNS = ('customer_carrier_name', 'customer_carrier_mode', 'tms_carrier_name', 'tms_carrier_mode')
+
+def with_string_keys(df, columns=KEY_COLUMNS):
+    """
+    键列 (默认 Product/Warehouse/Channel/State) 转为 string[pyarrow], 过滤与合并在 Arrow 中完成; 未安装 pyarrow 时原样返回
+    columns 可指定其他文本列, 如 WAREHOUSE_TEXT_COLUMNS
+    """
+    if KEY_STRING_DTYPE is None:
+        return df
+    return df.astype({col: KEY_STRING_DTYPE for col in columns if col in df.columns})
+
+def _sql_rows(df):
+    """DataFrame 行转为 executemany 参数, 缺失值 (NaN/pd.NA) 统一为 None"""
+    return df.astype(object).where(df.notna(), None).itertuples(index=False, name=None)
+
+_conn_local = threading.local()
+
+# 每个连接只设置一次: WAL 下 NORMAL 每次提交少一次 fsync; 数据库很小, 64MB 缓存 + mmap 可全部常驻内存
+# 不改用 file::memory:?cache=shared + 定期 backup: 共享缓存不支持 WAL, 进程崩溃会丢失已提交的修改,
+# 多进程也无法共享内存库 (data_rev 读缓存依赖同一个库文件); mmap 下读取已不经过 read() 系统调用
+CONNECTION_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-65536",
+    "PRAGMA mmap_size=268435456",
+    "PRAGMA wal_autocheckpoint=1000",
+)
 
 def get_connection():
-    """获取数据库连接"""
-    conn = sqlite3.connect(DB_FILE, timeout=30)
-    conn.execute("PRAGMA journal_mode=WAL")
+    """
+    获取数据库连接: 每个线程复用同一个连接, 不再每次调用都打开/关闭
+    连接只属于创建它的线程 (保留 sqlite3 的同线程检查), 线程结束时随 thread-local 一起关闭
+    调用方不再 close(); 写操作都在自己的 with conn: 块内提交或回滚, 不会留下未结束的事务
+    """
+    conn = getattr(_conn_local, 'conn', None)
+    if conn is None:
+        # 连接常驻, 语句缓存调大后热点 SQL 只编译一次
+        conn = sqlite3.connect(DB_FILE, timeout=30, cached_statements=256)
+        for pragma in CONNECTION_PRAGMAS:
+            conn.execute(pragma)
+        _conn_local.conn = conn
+    elif conn.in_transaction and not getattr(_conn_local, 'snapshot', False):
+        # 仍有未结束的事务说明某个写操作没有用 with conn: (或在提交前又取了连接): 回滚后报错, 不悄悄丢弃写入
+        conn.rollback()
+        raise RuntimeError("Uncommitted transaction left open on this thread's database connection")
     return conn
 
+@contextlib.contextmanager
+def _read_snapshot():
+    """
+    只读快照: 块内的所有读取共用一个读事务, 看到同一个 WAL 快照, 只加一次读锁
+    块内 get_connection() 不回滚该事务; 退出时结束事务 (块内只能读, 不能写)
+    """
+    conn = get_connection()
+    conn.execute("BEGIN")
+    _conn_local.snapshot = True
+    try:
+        yield conn
+    finally:
+        _conn_local.snapshot = False
+        conn.rollback()
+
+def _rows(conn, sql, params=()):
+    """小结果集直接取 sqlite3.Row 列表 (可按列名或下标取值), 不经过 pandas.read_sql"""
+    cursor = conn.cursor()
+    cursor.row_factory = sqlite3.Row
+    return cursor.execute(sql, params).fetchall()
+
+def _frame(conn, sql, params=()):
+    """
+    查询结果读成 DataFrame (所有 get_* 读函数共用): 跳过 read_sql 的封装层, 直接 from_records
+    coerce_float 与 read_sql 相同, 列类型不变; 空结果同样保留列名
+    """
+    cursor = conn.execute(sql, params)
+    columns = [d[0] for d in cursor.description]
+    return pd.DataFrame.from_records(cursor.fetchall(), columns=columns, coerce_float=True)
+
+# ============ 读缓存 (按数据版本号) ============
+
+SQL_GET_DATA_REV = "SELECT value FROM settings WHERE key = 'data_rev'"
+SQL_BUMP_DATA_REV = """
+    INSERT INTO settings (key, value) VALUES ('data_rev', '1')
+    ON CONFLICT(key) DO UPDATE SET value = CAST(value AS INTEGER) + 1
+"""
+
+def _data_revision():
+    """当前数据版本号; 每次写操作提交时加一"""
+    row = get_connection().execute(SQL_GET_DATA_REV).fetchone()
+    return row[0] if row else '0'
+
+def _bump_data_revision(conn):
+    """写操作在自己的事务内调用, 与数据修改一起提交, 使所有读缓存失效"""
+    conn.execute(SQL_BUMP_DATA_REV)
+
+# 参考数据 (承运商/费率/SKU/车辆) 单独的版本号: 只有这几张表的写操作才增加, 其他表的写操作不会使参考数据缓存失效
+SQL_GET_REFERENCE_REV = "SELECT value FROM settings WHERE key = 'reference_rev'"
+SQL_BUMP_REFERENCE_REV = """
+    INSERT INTO settings (key, value) VALUES ('reference_rev', '1')
+    ON CONFLICT(key) DO UPDATE SET value = CAST(value AS INTEGER) + 1
+"""
+
+def _reference_revision():
+    """当前参考数据版本号; 存于 settings 表, 其他进程的写操作同样可见"""
+    row = get_connection().execute(SQL_GET_REFERENCE_REV).fetchone()
+    return row[0] if row else '0'
+
+def _bump_reference_revision(conn):
+    """参考数据写操作在自己的事务内调用: 参考数据版本号和数据版本号一起加一"""
+    conn.execute(SQL_BUMP_REFERENCE_REV)
+    conn.execute(SQL_BUMP_DATA_REV)
+
+# 每个读函数最多保留的缓存条目: 只有当前版本号会被读到, 旧版本的条目按 LRU 淘汰, 内存不随写操作次数增长
+# 留出余量给同一版本下的不同参数 (如按仓库查询)
+VERSIONED_READ_MAX_ENTRIES = 16
+
+def _versioned_read(func):
+    """
+    读函数缓存 (st.cache_data), 键为 (数据版本号, 参数): 数据未变时跳过 SQL 查询和 DataFrame 构建
+    版本号存于 settings 表, 多进程/多会话之间同样有效; 位置参数和关键字参数都原样传给读函数
+    """
+    def cached(rev, *args, **kwargs):
+        return func(*args, **kwargs)
+    # st.cache_data 以函数名区分缓存, 每个读函数需要自己的名字
+    cached.__name__ = cached.__qualname__ = f"{func.__name__}_at_revision"
+    cached = st.cache_data(show_spinner=False, max_entries=VERSIONED_READ_MAX_ENTRIES)(cached)
+    
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        return cached(_data_revision(), *args, **kwargs)
+    return wrapper
+
+def _reference_read(func):
+    """
+    参考数据 (承运商/费率/SKU) 读函数缓存 (st.cache_resource), 键为参考数据版本号: 其他表的写操作不会使其失效
+    版本号存于数据库, 其他进程修改这几张表后同样重新读取; 每个调用方得到一份副本, 修改不会影响缓存
+    """
+    def cached(rev):
+        return func()
+    # st.cache_resource 以函数名区分缓存, 每个读函数需要自己的名字
+    cached.__name__ = cached.__qualname__ = f"{func.__name__}_at_reference_revision"
+    cached = st.cache_resource(show_spinner=False, max_entries=1)(cached)
+    
+    @functools.wraps(func)
+    def wrapper():
+        return cached(_reference_revision()).copy(deep=not PANDAS_COPY_ON_WRITE)
+    return wrapper
+
 def init_database():
     """初始化数据库表"""
     conn = get_connection()
@@ -160,438 +317,476 @@ def init_database():
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
         )
     """)
+    # 客户设置只有一行, 固定 id = 1 (保存时 UPSERT)
+    # 旧库的保存是 DELETE + INSERT, 唯一一行的 id 随保存次数递增: 保留最新一行并改为 id = 1
+    with conn:
+        cursor.execute("DELETE FROM customer_settings WHERE id < (SELECT MAX(id) FROM customer_settings)")
+        cursor.execute("UPDATE customer_settings SET id = 1 WHERE id <> 1")
     
-    conn.commit()
-    conn.close()
+    # 调度计划 + 仓库容量视图 (调度查询共用, 不再各自写 JOIN)
+    cursor.execute("""
+        CREATE VIEW IF NOT EXISTS warehouse_schedule_full AS
+        SELECT ws.id, ws.warehouse_name, ws.sku_code,
+               ws.incoming_week3, ws.incoming_week4, ws.outgoing_week1, ws.outgoing_week2,
+               w.capacity
+        FROM warehouse_schedule ws
+        JOIN warehouses w ON ws.warehouse_name = w.name
+    """)
+    
+    # 索引: 费率按 carrier + 距离区间查找; 库存按 SKU 查找
+    # ((warehouse_name, sku_code) 已由 UNIQUE 约束自带索引)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_rates_carrier_dist ON rates(carrier_id, min_distance, max_distance)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_wi_sku ON warehouse_inventory(sku_code)")
+
+# 种子数据涉及的表 (按插入顺序)
+SEED_TABLES = (
+    'carriers', 'vehicles', 'sku', 'warehouses', 'distribution_centers',
+    'demand_forecast', 'customer_allocation_plan', 'warehouse_schedule', 'customer_settings'
+)
 
 def seed_default_data():
     """插入默认数据（如果表为空）"""
     conn = get_connection()
     cursor = conn.cursor()
     
-    # 检查是否已有数据
-    cursor.execute("SELECT COUNT(*) FROM carriers")
-    if cursor.fetchone()[0] == 0:
-        # 插入默认Carriers
-        carriers = [
-            ('UPS', 'LTL', 'Less Than Truckload'),
-            ('FedEx', 'LTL', 'Less Than Truckload'),
-            ('XPO', 'FTL', 'Full Truckload'),
-            ('Old Dominion', 'LTL', 'Less Than Truckload'),
-            ('TMS', 'LTL', 'Our own fleet - Less Than Truckload'),
-            ('TMS', 'FTL', 'Our own fleet - Full Truckload')
-        ]
-        cursor.executemany("INSERT INTO carriers (name, mode, description) VALUES (?, ?, ?)", carriers)
-        
-        # 插入默认Rates
-        cursor.execute("SELECT id FROM carriers WHERE name = 'UPS'")
-        ups_id = cursor.fetchone()[0]
-        cursor.execute("SELECT id FROM carriers WHERE name = 'XPO'")
-        xpo_id = cursor.fetchone()[0]
-        cursor.execute("SELECT id FROM carriers WHERE name = 'FedEx'")
-        fedex_id = cursor.fetchone()[0]
-        
-        rates = [
-            (ups_id, 0, 500, 2.5, 25, 15),
-            (ups_id, 500, 1000, 2.2, 35, 15),
-            (ups_id, 1000, 99999, 1.8, 50, 15),
-            (xpo_id, 0, 2000, 4.5, 200, 100),
-            (xpo_id, 2000, 99999, 3.8, 300, 100),
-            (fedex_id, 0, 500, 2.8, 30, 20),
-            (fedex_id, 500, 1000, 2.4, 40, 20),
-        ]
-        cursor.executemany("""
-            INSERT INTO rates (carrier_id, min_distance, max_distance, rate_per_mile, minimum_charge, fixed_cost) 
-            VALUES (?, ?, ?, ?, ?, ?)
-        """, rates)
+    # 整个种子过程是一个写事务: 空表检查与插入原子完成, 末尾只提交 (fsync) 一次; 出错时整体回滚
+    with conn:
+        cursor.execute("BEGIN IMMEDIATE")
         
-        # 添加TMS费率
-        cursor.execute("SELECT id FROM carriers WHERE name = 'TMS' AND mode = 'LTL'")
-        result = cursor.fetchone()
-        tms_ltl_id = result[0] if result else None
-        cursor.execute("SELECT id FROM carriers WHERE name = 'TMS' AND mode = 'FTL'")
-        result = cursor.fetchone()
-        tms_ftl_id = result[0] if result else None
+        # 一条查询取得所有种子表是否已有数据 (EXISTS 读到第一行即停, 不做 COUNT(*) 全表计数)
+        # 只给空表种子, 用户删掉的默认行不会在下次启动时被补回
+        cursor.execute("SELECT " + ", ".join(f"EXISTS(SELECT 1 FROM {t})" for t in SEED_TABLES))
+        has_rows = dict(zip(SEED_TABLES, cursor.fetchone()))
         
-        if tms_ltl_id:
-            tms_rates = [
-                (tms_ltl_id, 0, 500, 2.0, 20, 10),
-                (tms_ltl_id, 500, 1000, 1.8, 25, 10),
-                (tms_ltl_id, 1000, 99999, 1.5, 30, 10),
+        # 检查是否已有数据
+        if not has_rows['carriers']:
+            # 插入默认Carriers
+            carriers = [
+                ('UPS', 'LTL', 'Less Than Truckload'),
+                ('FedEx', 'LTL', 'Less Than Truckload'),
+                ('XPO', 'FTL', 'Full Truckload'),
+                ('Old Dominion', 'LTL', 'Less Than Truckload'),
+                ('TMS', 'LTL', 'Our own fleet - Less Than Truckload'),
+                ('TMS', 'FTL', 'Our own fleet - Full Truckload')
             ]
+            cursor.executemany("INSERT OR IGNORE INTO carriers (name, mode, description) VALUES (?, ?, ?)", carriers)
+            
+            # 承运商 id 一次查出, 按 (name, mode) 查找, 不再逐个 SELECT
+            carrier_ids = {(name, mode): carrier_id for carrier_id, name, mode in cursor.execute("SELECT id, name, mode FROM carriers")}
+            ups_id = carrier_ids[('UPS', 'LTL')]
+            xpo_id = carrier_ids[('XPO', 'FTL')]
+            fedex_id = carrier_ids[('FedEx', 'LTL')]
+            
+            # 插入默认Rates (含TMS费率, 一次 executemany)
+            rates = [
+                (ups_id, 0, 500, 2.5, 25, 15),
+                (ups_id, 500, 1000, 2.2, 35, 15),
+                (ups_id, 1000, 99999, 1.8, 50, 15),
+                (xpo_id, 0, 2000, 4.5, 200, 100),
+                (xpo_id, 2000, 99999, 3.8, 300, 100),
+                (fedex_id, 0, 500, 2.8, 30, 20),
+                (fedex_id, 500, 1000, 2.4, 40, 20),
+            ]
+            
+            # 添加TMS费率
+            tms_ltl_id = carrier_ids.get(('TMS', 'LTL'))
+            tms_ftl_id = carrier_ids.get(('TMS', 'FTL'))
+            
+            if tms_ltl_id:
+                rates += [
+                    (tms_ltl_id, 0, 500, 2.0, 20, 10),
+                    (tms_ltl_id, 500, 1000, 1.8, 25, 10),
+                    (tms_ltl_id, 1000, 99999, 1.5, 30, 10),
+                ]
+            
+            if tms_ftl_id:
+                rates += [
+                    (tms_ftl_id, 0, 2000, 3.5, 150, 80),
+                    (tms_ftl_id, 2000, 99999, 3.0, 200, 80),
+                ]
+            
             cursor.executemany("""
                 INSERT INTO rates (carrier_id, min_distance, max_distance, rate_per_mile, minimum_charge, fixed_cost) 
                 VALUES (?, ?, ?, ?, ?, ?)
-            """, tms_rates)
-        
-        if tms_ftl_id:
-            tms_ftl_rates = [
-                (tms_ftl_id, 0, 2000, 3.5, 150, 80),
-                (tms_ftl_id, 2000, 99999, 3.0, 200, 80),
+            """, rates)
+            
+        # 检查Vehicles (车辆类型)
+        if not has_rows['vehicles']:
+            vehicles = [
+                ('53\' Trailer', 636, 96, 108, 45000, 'Standard 53 foot trailer'),
+                ('40\' Trailer', 480, 96, 108, 40000, 'Standard 40 foot trailer'),
             ]
             cursor.executemany("""
-                INSERT INTO rates (carrier_id, min_distance, max_distance, rate_per_mile, minimum_charge, fixed_cost) 
+                INSERT OR IGNORE INTO vehicles (name, length_inches, width_inches, height_inches, max_weight_lbs, description) 
                 VALUES (?, ?, ?, ?, ?, ?)
-            """, tms_ftl_rates)
-        
-    # 检查Vehicles (车辆类型)
-    cursor.execute("SELECT COUNT(*) FROM vehicles")
-    if cursor.fetchone()[0] == 0:
-        vehicles = [
-            ('53\' Trailer', 636, 96, 108, 45000, 'Standard 53 foot trailer'),
-            ('40\' Trailer', 480, 96, 108, 40000, 'Standard 40 foot trailer'),
-        ]
-        cursor.executemany("""
-            INSERT INTO vehicles (name, length_inches, width_inches, height_inches, max_weight_lbs, description) 
-            VALUES (?, ?, ?, ?, ?, ?)
-        """, vehicles)
-    
-    # 检查SKU
-    cursor.execute("SELECT COUNT(*) FROM sku")
-    if cursor.fetchone()[0] == 0:
-        sku_data = [
-            ('32Q21K', 'Product A', 12, 8, 6, 5, 'each'),
-            ('SKU-B001', 'Product B', 24, 18, 12, 15, 'case'),
-            ('SKU-C002', 'Product C', 48, 40, 36, 45, 'pallet'),
-        ]
-        cursor.executemany("""
-            INSERT INTO sku (sku_code, name, length_in, width_in, height_in, weight_lbs, unit_type) 
-            VALUES (?, ?, ?, ?, ?, ?, ?)
-        """, sku_data)
+            """, vehicles)
         
-    # 检查Warehouses
-    cursor.execute("SELECT COUNT(*) FROM warehouses")
-    if cursor.fetchone()[0] == 0:
-        warehouses = [
-            ('EL PASO', '12100 Emerald Pass Drive, El Paso, TX 79936', 10000),
-            ('Valley View', '6800 Valley View St, Buena Park, CA 90620', 12000),
-            ('Seabrook', '300 Seabrook Parkway, Pooler, GA 31322', 9000),
-            ('Cesanek', '175 Cesanek Rd., Northampton, PA 18067', 11000),
-        ]
-        cursor.executemany("""
-            INSERT INTO warehouses (name, address, capacity) 
-            VALUES (?, ?, ?)
-        """, warehouses)
-        
-    # 检查Distribution Centers
-    cursor.execute("SELECT COUNT(*) FROM distribution_centers")
-    if cursor.fetchone()[0] == 0:
-        dcs = [
-            ('Amazon', 'CA', 'San Francisco, CA'),
-            ('Walmart', 'TX', 'Dallas, TX'),
-            ('Target', 'GA', 'Atlanta, GA'),
-            ('Amazon', 'PA', 'Philadelphia, PA'),
-        ]
-        cursor.executemany("INSERT INTO distribution_centers (channel, state, address) VALUES (?, ?, ?)", dcs)
-        
-    # 检查Demand Forecast
-    cursor.execute("SELECT COUNT(*) FROM demand_forecast")
-    if cursor.fetchone()[0] == 0:
-        demand = [
-            ('32Q21K', 'Amazon', 'CA', 2200, 2300),
-            ('32Q21K', 'Walmart', 'TX', 1800, 1900),
-            ('32Q21K', 'Target', 'GA', 1600, 1700),
-            ('32Q21K', 'Amazon', 'PA', 1900, 2000),
-        ]
-        cursor.executemany("INSERT INTO demand_forecast (product, channel, state, demand_week3, demand_week4) VALUES (?, ?, ?, ?, ?)", demand)
-        
-    # 检查Customer Allocation Plan
-    cursor.execute("SELECT COUNT(*) FROM customer_allocation_plan")
-    if cursor.fetchone()[0] == 0:
-        plan = [
-            ('32Q21K', 'Valley View', 'Amazon', 'CA', 2200, 2300),
-            ('32Q21K', 'EL PASO', 'Walmart', 'TX', 1800, 1900),
-            ('32Q21K', 'EL PASO', 'Target', 'GA', 1600, 1700),
-            ('32Q21K', 'Cesanek', 'Amazon', 'PA', 1900, 2000),
-        ]
-        cursor.executemany("""
-            INSERT INTO customer_allocation_plan (product, warehouse, channel, state, allocated_units_week3, allocated_units_week4) 
-            VALUES (?, ?, ?, ?, ?, ?)
-        """, plan)
-    
-    # 检查Warehouse Schedule
-    cursor.execute("SELECT COUNT(*) FROM warehouse_schedule")
-    if cursor.fetchone()[0] == 0:
-        schedule = [
-            ('EL PASO', '32Q21K', 200, 250, 300, 350),
-            ('Valley View', '32Q21K', 300, 350, 400, 450),
-            ('Seabrook', '32Q21K', 150, 200, 200, 250),
-            ('Cesanek', '32Q21K', 200, 250, 150, 200),
-        ]
-        cursor.executemany("""
-            INSERT INTO warehouse_schedule (warehouse_name, sku_code, incoming_week3, incoming_week4, outgoing_week1, outgoing_week2) 
-            VALUES (?, ?, ?, ?, ?, ?)
-        """, schedule)
-    
-    # 检查Customer Settings (默认选择UPS作为customer carrier, TMS用TMS LTL)
-    cursor.execute("SELECT COUNT(*) FROM customer_settings")
-    if cursor.fetchone()[0] == 0:
-        cursor.execute("SELECT id FROM carriers WHERE name = 'UPS'")
-        result = cursor.fetchone()
-        customer_carrier = result[0] if result else None
+        # 检查SKU
+        if not has_rows['sku']:
+            sku_data = [
+                ('32Q21K', 'Product A', 12, 8, 6, 5, 'each'),
+                ('SKU-B001', 'Product B', 24, 18, 12, 15, 'case'),
+                ('SKU-C002', 'Product C', 48, 40, 36, 45, 'pallet'),
+            ]
+            cursor.executemany("""
+                INSERT OR IGNORE INTO sku (sku_code, name, length_in, width_in, height_in, weight_lbs, unit_type) 
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            """, sku_data)
+            
+        # 检查Warehouses
+        if not has_rows['warehouses']:
+            warehouses = [
+                ('EL PASO', '12100 Emerald Pass Drive, El Paso, TX 79936', 10000),
+                ('Valley View', '6800 Valley View St, Buena Park, CA 90620', 12000),
+                ('Seabrook', '300 Seabrook Parkway, Pooler, GA 31322', 9000),
+                ('Cesanek', '175 Cesanek Rd., Northampton, PA 18067', 11000),
+            ]
+            cursor.executemany("""
+                INSERT OR IGNORE INTO warehouses (name, address, capacity) 
+                VALUES (?, ?, ?)
+            """, warehouses)
+            
+        # 检查Distribution Centers
+        if not has_rows['distribution_centers']:
+            dcs = [
+                ('Amazon', 'CA', 'San Francisco, CA'),
+                ('Walmart', 'TX', 'Dallas, TX'),
+                ('Target', 'GA', 'Atlanta, GA'),
+                ('Amazon', 'PA', 'Philadelphia, PA'),
+            ]
+            cursor.executemany("INSERT INTO distribution_centers (channel, state, address) VALUES (?, ?, ?)", dcs)
+            
+        # 检查Demand Forecast
+        if not has_rows['demand_forecast']:
+            demand = [
+                ('32Q21K', 'Amazon', 'CA', 2200, 2300),
+                ('32Q21K', 'Walmart', 'TX', 1800, 1900),
+                ('32Q21K', 'Target', 'GA', 1600, 1700),
+                ('32Q21K', 'Amazon', 'PA', 1900, 2000),
+            ]
+            cursor.executemany("INSERT INTO demand_forecast (product, channel, state, demand_week3, demand_week4) VALUES (?, ?, ?, ?, ?)", demand)
+            
+        # 检查Customer Allocation Plan
+        if not has_rows['customer_allocation_plan']:
+            plan = [
+                ('32Q21K', 'Valley View', 'Amazon', 'CA', 2200, 2300),
+                ('32Q21K', 'EL PASO', 'Walmart', 'TX', 1800, 1900),
+                ('32Q21K', 'EL PASO', 'Target', 'GA', 1600, 1700),
+                ('32Q21K', 'Cesanek', 'Amazon', 'PA', 1900, 2000),
+            ]
+            cursor.executemany("""
+                INSERT INTO customer_allocation_plan (product, warehouse, channel, state, allocated_units_week3, allocated_units_week4) 
+                VALUES (?, ?, ?, ?, ?, ?)
+            """, plan)
         
-        cursor.execute("SELECT id FROM carriers WHERE name = 'TMS' AND mode = 'LTL'")
-        result = cursor.fetchone()
-        tms_carrier = result[0] if result else None
+        # 检查Warehouse Schedule
+        if not has_rows['warehouse_schedule']:
+            schedule = [
+                ('EL PASO', '32Q21K', 200, 250, 300, 350),
+                ('Valley View', '32Q21K', 300, 350, 400, 450),
+                ('Seabrook', '32Q21K', 150, 200, 200, 250),
+                ('Cesanek', '32Q21K', 200, 250, 150, 200),
+            ]
+            cursor.executemany("""
+                INSERT OR IGNORE INTO warehouse_schedule (warehouse_name, sku_code, incoming_week3, incoming_week4, outgoing_week1, outgoing_week2) 
+                VALUES (?, ?, ?, ?, ?, ?)
+            """, schedule)
         
-        if customer_carrier and tms_carrier:
-            cursor.execute("INSERT INTO customer_settings (customer_carrier_id, tms_carrier_id) VALUES (?, ?)",
-                         (customer_carrier, tms_carrier))
+        # 检查Customer Settings (默认选择UPS作为customer carrier, TMS用TMS LTL)
+        if not has_rows['customer_settings']:
+            carrier_ids = {(name, mode): carrier_id for carrier_id, name, mode in cursor.execute("SELECT id, name, mode FROM carriers")}
+            customer_carrier = carrier_ids.get(('UPS', 'LTL'))
+            tms_carrier = carrier_ids.get(('TMS', 'LTL'))
+            
+            if customer_carrier and tms_carrier:
+                cursor.execute(SQL_SAVE_CUSTOMER_SETTINGS, (customer_carrier, tms_carrier))
     
-    conn.commit()
-    conn.close()
+    # 首次建库后收集一次统计信息 (sqlite_stat1), 供查询规划器选择索引
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE name = 'sqlite_stat1'")
+    if cursor.fetchone() is None:
+        with conn:
+            conn.execute("ANALYZE")
 
 # ============ CRUD Operations ============
 
+@_reference_read
 def get_all_carriers():
     conn = get_connection()
-    df = pd.read_sql("SELECT * FROM carriers", conn)
-    conn.close()
+    df = _frame(conn, "SELECT * FROM carriers")
     return df
 
 def add_carrier(name, mode, description=""):
     conn = get_connection()
     cursor = conn.cursor()
     try:
-        cursor.execute("INSERT INTO carriers (name, mode, description) VALUES (?, ?, ?)", (name, mode, description))
-        conn.commit()
-        return True, "Carrier added successfully"
+        with conn:
+            cursor.execute("INSERT INTO carriers (name, mode, description) VALUES (?, ?, ?)", (name, mode, description))
+            _bump_reference_revision(conn)
     except sqlite3.IntegrityError:
         return False, "Carrier already exists"
-    finally:
-        conn.close()
+    return True, "Carrier added successfully"
 
 def delete_carrier(carrier_id):
     conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute("DELETE FROM rates WHERE carrier_id = ?", (carrier_id,))
-    cursor.execute("DELETE FROM carriers WHERE id = ?", (carrier_id,))
-    conn.commit()
-    conn.close()
+    with conn:
+        cursor = conn.cursor()
+        cursor.execute("DELETE FROM rates WHERE carrier_id = ?", (carrier_id,))
+        cursor.execute("DELETE FROM carriers WHERE id = ?", (carrier_id,))
+        _bump_reference_revision(conn)
 
+@_reference_read
 def get_rates_with_carrier():
     conn = get_connection()
-    df = pd.read_sql("""
+    df = _frame(conn, """
         SELECT r.id, r.carrier_id, c.name as carrier_name, c.mode, 
                r.min_distance, r.max_distance, r.rate_per_mile, r.minimum_charge, r.fixed_cost
         FROM rates r
         JOIN carriers c ON r.carrier_id = c.id
-    """, conn)
-    conn.close()
+    """)
     return df
 
 def add_rate(carrier_id, min_dist, max_dist, rate_per_mile, minimum, fixed_cost):
     conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute("""
-        INSERT INTO rates (carrier_id, min_distance, max_distance, rate_per_mile, minimum_charge, fixed_cost) 
-        VALUES (?, ?, ?, ?, ?, ?)
-    """, (carrier_id, min_dist, max_dist, rate_per_mile, minimum, fixed_cost))
-    conn.commit()
-    conn.close()
+    with conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+            INSERT INTO rates (carrier_id, min_distance, max_distance, rate_per_mile, minimum_charge, fixed_cost) 
+            VALUES (?, ?, ?, ?, ?, ?)
+        """, (carrier_id, min_dist, max_dist, rate_per_mile, minimum, fixed_cost))
+        _bump_reference_revision(conn)
 
 def delete_rate(rate_id):
     conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute("DELETE FROM rates WHERE id = ?", (rate_id,))
-    conn.commit()
-    conn.close()
+    with conn:
+        cursor = conn.cursor()
+        cursor.execute("DELETE FROM rates WHERE id = ?", (rate_id,))
+        _bump_reference_revision(conn)
 
+@_reference_read
 def get_all_sku():
     conn = get_connection()
-    df = pd.read_sql("SELECT * FROM sku", conn)
-    conn.close()
+    df = _frame(conn, "SELECT * FROM sku")
+    # 体积重在加载时算一次, 页面直接展示
+    df['Dim_Weight'] = calculate_dim_weight(df['length_in'], df['width_in'], df['height_in'])
     return df
 
 def add_sku(sku_code, name, length, width, height, weight, unit_type):
     conn = get_connection()
     cursor = conn.cursor()
     try:
-        cursor.execute("""
-            INSERT INTO sku (sku_code, name, length_in, width_in, height_in, weight_lbs, unit_type) 
-            VALUES (?, ?, ?, ?, ?, ?, ?)
-        """, (sku_code, name, length, width, height, weight, unit_type))
-        conn.commit()
-        return True, "SKU added successfully"
+        with conn:
+            cursor.execute("""
+                INSERT INTO sku (sku_code, name, length_in, width_in, height_in, weight_lbs, unit_type) 
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            """, (sku_code, name, length, width, height, weight, unit_type))
+            _bump_reference_revision(conn)
     except sqlite3.IntegrityError:
         return False, "SKU code already exists"
-    finally:
-        conn.close()
+    return True, "SKU added successfully"
 
 def update_sku(sku_id, sku_code, name, length, width, height, weight, unit_type):
     conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute("""
-        UPDATE sku SET sku_code=?, name=?, length_in=?, width_in=?, height_in=?, weight_lbs=?, unit_type=?
-        WHERE id=?
-    """, (sku_code, name, length, width, height, weight, unit_type, sku_id))
-    conn.commit()
-    conn.close()
+    with conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+            UPDATE sku SET sku_code=?, name=?, length_in=?, width_in=?, height_in=?, weight_lbs=?, unit_type=?
+            WHERE id=?
+        """, (sku_code, name, length, width, height, weight, unit_type, sku_id))
+        _bump_reference_revision(conn)
 
 def delete_sku(sku_id):
     conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute("DELETE FROM sku WHERE id = ?", (sku_id,))
-    conn.commit()
-    conn.close()
+    with conn:
+        cursor = conn.cursor()
+        cursor.execute("DELETE FROM sku WHERE id = ?", (sku_id,))
+        _bump_reference_revision(conn)
+
+# get_warehouse_inventory 可选的列 (列名 -> SQL 表达式), 顺序即默认的全部列; 来自 sku 表的列需要 JOIN
+INVENTORY_COLUMNS = {
+    'id': 'wi.id',
+    'warehouse_name': 'wi.warehouse_name',
+    'sku_code': 'wi.sku_code',
+    'sku_name': 's.name',
+    'length_in': 's.length_in',
+    'width_in': 's.width_in',
+    'height_in': 's.height_in',
+    'weight_lbs': 's.weight_lbs',
+    'quantity_on_hand': 'wi.quantity_on_hand',
+    'quantity_in_transit': 'wi.quantity_in_transit',
+}
 
-def get_warehouse_inventory():
+@_versioned_read
+def get_warehouse_inventory(columns=None, warehouse_name=None):
+    """
+    仓库库存 (可选列投影和按仓库过滤, 只把需要的列/行从 SQLite 取出)
+    columns: INVENTORY_COLUMNS 中的列名 (元组或列表), None 为全部列; 只有用到 SKU 信息时才 JOIN sku 表
+    两个参数都可按位置或关键字传入 (columns=..., warehouse_name=...)
+    """
+    columns = tuple(columns) if columns else tuple(INVENTORY_COLUMNS)
+    unknown = [col for col in columns if col not in INVENTORY_COLUMNS]
+    if unknown:
+        raise ValueError(f"Unknown inventory columns: {unknown}")
+    
+    select = ", ".join(f"{INVENTORY_COLUMNS[col]} AS {col}" for col in columns)
+    sql = f"SELECT {select} FROM warehouse_inventory wi"
+    if any(INVENTORY_COLUMNS[col].startswith('s.') for col in columns):
+        sql += " LEFT JOIN sku s ON wi.sku_code = s.sku_code"
+    params = ()
+    if warehouse_name is not None:
+        sql += " WHERE wi.warehouse_name = ?"
+        params = (warehouse_name,)
+    
     conn = get_connection()
-    df = pd.read_sql("""
-        SELECT wi.id, wi.warehouse_name, wi.sku_code, s.name as sku_name, 
-               s.length_in, s.width_in, s.height_in, s.weight_lbs,
-               wi.quantity_on_hand, wi.quantity_in_transit
-        FROM warehouse_inventory wi
-        LEFT JOIN sku s ON wi.sku_code = s.sku_code
-    """, conn)
-    conn.close()
-    return df
+    return _frame(conn, sql, params)
 
+@_versioned_read
 def get_warehouse_inventory_by_warehouse(warehouse_name):
     conn = get_connection()
-    df = pd.read_sql("""
+    df = _frame(conn, """
         SELECT wi.*, s.name as sku_name, s.length_in, s.width_in, s.height_in, s.weight_lbs
         FROM warehouse_inventory wi
         LEFT JOIN sku s ON wi.sku_code = s.sku_code
         WHERE wi.warehouse_name = ?
-    """, conn, params=(warehouse_name,))
-    conn.close()
+    """, (warehouse_name,))
     return df
 
+# 热点写操作使用固定的 SQL 常量: 文本相同即命中连接的预编译语句缓存
+SQL_UPSERT_INVENTORY = """
+    INSERT INTO warehouse_inventory (warehouse_name, sku_code, quantity_on_hand, quantity_in_transit)
+    VALUES (?, ?, ?, ?)
+    ON CONFLICT(warehouse_name, sku_code) DO UPDATE SET
+        quantity_on_hand = excluded.quantity_on_hand,
+        quantity_in_transit = excluded.quantity_in_transit
+"""
+
 def update_warehouse_inventory(warehouse_name, sku_code, qty_on_hand, qty_in_transit):
     conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute("""
-        INSERT INTO warehouse_inventory (warehouse_name, sku_code, quantity_on_hand, quantity_in_transit)
-        VALUES (?, ?, ?, ?)
-        ON CONFLICT(warehouse_name, sku_code) DO UPDATE SET
-            quantity_on_hand = excluded.quantity_on_hand,
-            quantity_in_transit = excluded.quantity_in_transit
-    """, (warehouse_name, sku_code, qty_on_hand, qty_in_transit))
-    conn.commit()
-    conn.close()
+    with conn:
+        conn.execute(SQL_UPSERT_INVENTORY, (warehouse_name, sku_code, qty_on_hand, qty_in_transit))
+        _bump_data_revision(conn)
 
 # ============ Warehouse Schedule ============
 
+@_versioned_read
 def get_warehouse_schedule():
     conn = get_connection()
-    df = pd.read_sql("""
-        SELECT ws.*, w.capacity
-        FROM warehouse_schedule ws
-        JOIN warehouses w ON ws.warehouse_name = w.name
-    """, conn)
-    conn.close()
-    df = df.rename(columns={
-        'warehouse_name': 'Warehouse',
-        'sku_code': 'SKU',
-        'incoming_week3': 'Incoming_Week3',
-        'incoming_week4': 'Incoming_Week4',
-        'outgoing_week1': 'Outgoing_Week1',
-        'outgoing_week2': 'Outgoing_Week2'
-    })
+    # 列名大写在 SELECT 中用别名完成, 不再对结果做 rename
+    df = _frame(conn, """
+        SELECT id, warehouse_name AS "Warehouse", sku_code AS "SKU",
+               incoming_week3 AS "Incoming_Week3", incoming_week4 AS "Incoming_Week4",
+               outgoing_week1 AS "Outgoing_Week1", outgoing_week2 AS "Outgoing_Week2",
+               capacity
+        FROM warehouse_schedule_full
+    """)
     return df
 
+@_versioned_read
 def get_warehouse_schedule_by_warehouse(warehouse_name):
     conn = get_connection()
-    df = pd.read_sql("""
-        SELECT ws.*, w.capacity
-        FROM warehouse_schedule ws
-        JOIN warehouses w ON ws.warehouse_name = w.name
-        WHERE ws.warehouse_name = ?
-    """, conn, params=(warehouse_name,))
-    conn.close()
+    df = _frame(conn, "SELECT * FROM warehouse_schedule_full WHERE warehouse_name = ?", (warehouse_name,))
     return df
 
-def save_warehouse_schedule(warehouse_name, sku_code, in_w3, in_w4, out_w1, out_w2):
+SQL_UPSERT_SCHEDULE = """
+    INSERT INTO warehouse_schedule (warehouse_name, sku_code, incoming_week3, incoming_week4, outgoing_week1, outgoing_week2)
+    VALUES (?, ?, ?, ?, ?, ?)
+    ON CONFLICT(warehouse_name, sku_code) DO UPDATE SET
+        incoming_week3 = excluded.incoming_week3,
+        incoming_week4 = excluded.incoming_week4,
+        outgoing_week1 = excluded.outgoing_week1,
+        outgoing_week2 = excluded.outgoing_week2
+"""
+
+def save_warehouse_schedule(warehouse_name, sku_code, in_w3, in_w4, out_w1, out_w2, inventory=None):
+    """inventory 为 (qty_on_hand, qty_in_transit) 时, 在同一事务内一并更新该仓库+SKU的库存, 只提交一次"""
     conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute("""
-        INSERT INTO warehouse_schedule (warehouse_name, sku_code, incoming_week3, incoming_week4, outgoing_week1, outgoing_week2)
-        VALUES (?, ?, ?, ?, ?, ?)
-        ON CONFLICT(warehouse_name, sku_code) DO UPDATE SET
-            incoming_week3 = excluded.incoming_week3,
-            incoming_week4 = excluded.incoming_week4,
-            outgoing_week1 = excluded.outgoing_week1,
-            outgoing_week2 = excluded.outgoing_week2
-    """, (warehouse_name, sku_code, in_w3, in_w4, out_w1, out_w2))
-    conn.commit()
-    conn.close()
+    with conn:
+        conn.execute(SQL_UPSERT_SCHEDULE, (warehouse_name, sku_code, in_w3, in_w4, out_w1, out_w2))
+        if inventory is not None:
+            conn.execute(SQL_UPSERT_INVENTORY, (warehouse_name, sku_code, *inventory))
+        _bump_data_revision(conn)
+
+# ?1 = week, ?2 = warehouse_name, ?3 = sku_code
+# 第3周: 现有 + 第3周入库 - 第1、2周出库; 第4周再加第4周入库; 其他周只算现有库存
+SQL_AVAILABLE_INVENTORY = """
+    SELECT MAX(0,
+        COALESCE(wi.quantity_on_hand, 0)
+        + CASE WHEN ?1 IN (3, 4)
+               THEN COALESCE(ws.incoming_week3, 0) - COALESCE(ws.outgoing_week1, 0) - COALESCE(ws.outgoing_week2, 0)
+               ELSE 0 END
+        + CASE WHEN ?1 = 4 THEN COALESCE(ws.incoming_week4, 0) ELSE 0 END)
+    FROM warehouse_schedule ws
+    JOIN warehouses w ON ws.warehouse_name = w.name
+    LEFT JOIN warehouse_inventory wi
+        ON ws.warehouse_name = wi.warehouse_name AND ws.sku_code = wi.sku_code
+    WHERE ws.warehouse_name = ?2 AND ws.sku_code = ?3
+"""
 
 def calculate_available_inventory(warehouse_name, sku_code, week):
-    """计算特定仓库、SKU在某周的可用库存"""
-    schedule = get_warehouse_schedule_by_warehouse(warehouse_name)
-    
-    if schedule.empty or sku_code not in schedule['sku_code'].values:
-        return 0
-    
-    sku_row = schedule[schedule['sku_code'] == sku_code]
-    if sku_row.empty:
-        return 0
-    
-    inv = sku_row.iloc[0]
-    current = inv.get('quantity_on_hand', 0)
-    in_w3 = inv.get('incoming_week3', 0)
-    in_w4 = inv.get('incoming_week4', 0)
-    out_w1 = inv.get('outgoing_week1', 0)
-    out_w2 = inv.get('outgoing_week2', 0)
-    
-    if week == 3:
-        available = current + in_w3 - out_w1 - out_w2
-    elif week == 4:
-        available = current + in_w3 + in_w4 - out_w1 - out_w2
-    else:
-        available = current
+    """计算特定仓库、SKU在某周的可用库存 (整个算式在 SQL 中完成, 只取回一个标量; 与 get_availability_matrix 口径一致)"""
+    row = get_connection().execute(SQL_AVAILABLE_INVENTORY, (week, warehouse_name, sku_code)).fetchone()
+    return row[0] if row else 0
+
+@_versioned_read
+def get_availability_matrix():
+    """
+    一次查询计算所有仓库+SKU第3、4周的可用库存 (替代逐格调用 calculate_available_inventory)
+    与 calculate_available_inventory 相同, 只计算仓库仍存在的调度行 (JOIN warehouses)
+    """
+    conn = get_connection()
+    df = _frame(conn, """
+        SELECT ws.warehouse_name, ws.sku_code,
+               COALESCE(wi.quantity_on_hand, 0) AS current_inv,
+               COALESCE(ws.incoming_week3, 0) AS in_w3,
+               COALESCE(ws.incoming_week4, 0) AS in_w4,
+               COALESCE(ws.outgoing_week1, 0) AS out_w1,
+               COALESCE(ws.outgoing_week2, 0) AS out_w2
+        FROM warehouse_schedule ws
+        JOIN warehouses w ON ws.warehouse_name = w.name
+        LEFT JOIN warehouse_inventory wi
+            ON ws.warehouse_name = wi.warehouse_name AND ws.sku_code = wi.sku_code
+    """)
     
-    return max(0, available)
+    base = df['current_inv'] + df['in_w3'] - df['out_w1'] - df['out_w2']
+    df['Available_Week3'] = base.clip(lower=0)
+    df['Available_Week4'] = (base + df['in_w4']).clip(lower=0)
+    return df
 
 # ============ Vehicles ============
 
+@_versioned_read
 def get_vehicles():
     conn = get_connection()
-    df = pd.read_sql("SELECT * FROM vehicles", conn)
-    conn.close()
+    df = _frame(conn, "SELECT * FROM vehicles")
     return df
 
 def add_vehicle(name, length, width, height, max_weight, description=""):
     conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute("""
-        INSERT INTO vehicles (name, length_inches, width_inches, height_inches, max_weight_lbs, description) 
-        VALUES (?, ?, ?, ?, ?, ?)
-    """, (name, length, width, height, max_weight, description))
-    conn.commit()
-    conn.close()
+    with conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+            INSERT INTO vehicles (name, length_inches, width_inches, height_inches, max_weight_lbs, description) 
+            VALUES (?, ?, ?, ?, ?, ?)
+        """, (name, length, width, height, max_weight, description))
+        _bump_reference_revision(conn)
 
-def calculate_max_units_per_vehicle(sku_code, vehicle_id=None):
+SQL_SKU_DIMS = "SELECT length_in, width_in, height_in, weight_lbs FROM sku WHERE sku_code = ?"
+
+def _vehicle_capacities(conn, sku_dims, vehicle_id=None):
     """
-    计算每辆车能装多少单位
-    使用 0.85 markup factor
+    按已取出的SKU尺寸 (length, width, height, weight) 计算每辆车的装载量
+    复用调用方的连接, 车辆按 sqlite3.Row 逐行读取, 不再重复查询SKU
     """
-    conn = get_connection()
-    
-    # Get SKU info
-    sku_df = pd.read_sql("SELECT * FROM sku WHERE sku_code = ?", conn, params=(sku_code,))
-    if sku_df.empty:
-        conn.close()
-        return 0, "SKU not found"
-    
-    sku = sku_df.iloc[0]
-    sku_volume = sku['length_in'] * sku['width_in'] * sku['height_in']  # cubic inches
-    sku_weight = sku['weight_lbs']
+    length, width, height, sku_weight = sku_dims
+    sku_volume = length * width * height  # cubic inches
     
     # Get vehicles
     if vehicle_id:
-        vehicles_df = pd.read_sql("SELECT * FROM vehicles WHERE id = ?", conn, params=(vehicle_id,))
+        vehicles = _rows(conn, "SELECT * FROM vehicles WHERE id = ?", (vehicle_id,))
     else:
-        vehicles_df = pd.read_sql("SELECT * FROM vehicles", conn)
-    
-    conn.close()
-    
-    if vehicles_df.empty:
-        return 0, "No vehicles found"
+        vehicles = _rows(conn, "SELECT * FROM vehicles")
     
     results = []
-    for _, vehicle in vehicles_df.iterrows():
+    for vehicle in vehicles:
         vehicle_volume = vehicle['length_inches'] * vehicle['width_inches'] * vehicle['height_inches']
         max_weight = vehicle['max_weight_lbs']
         
@@ -615,210 +810,362 @@ def calculate_max_units_per_vehicle(sku_code, vehicle_id=None):
             'usable_weight': usable_weight
         })
     
+    return results
+
+def calculate_max_units_per_vehicle(sku_code, vehicle_id=None):
+    """
+    计算每辆车能装多少单位
+    使用 0.85 markup factor
+    """
+    conn = get_connection()
+    
+    # Get SKU info
+    sku_dims = conn.execute(SQL_SKU_DIMS, (sku_code,)).fetchone()
+    if sku_dims is None:
+        return 0, "SKU not found"
+    
+    results = _vehicle_capacities(conn, sku_dims, vehicle_id)
+    if not results:
+        return 0, "No vehicles found"
+    
     return results, None
 
 # ============ Customer Settings ============
 
+# 单行设置 (id = 1): 一次 UPSERT 代替 DELETE + INSERT; created_at 记录最后保存时间
+SQL_SAVE_CUSTOMER_SETTINGS = """
+    INSERT INTO customer_settings (id, customer_carrier_id, tms_carrier_id) VALUES (1, ?, ?)
+    ON CONFLICT(id) DO UPDATE SET
+        customer_carrier_id = excluded.customer_carrier_id,
+        tms_carrier_id = excluded.tms_carrier_id,
+        created_at = CURRENT_TIMESTAMP
+"""
+
+@_versioned_read
 def get_customer_settings():
     conn = get_connection()
-    df = pd.read_sql("""
+    df = _frame(conn, """
         SELECT cs.*, 
                c1.name as customer_carrier_name, c1.mode as customer_carrier_mode,
                c2.name as tms_carrier_name, c2.mode as tms_carrier_mode
         FROM customer_settings cs
         LEFT JOIN carriers c1 ON cs.customer_carrier_id = c1.id
         LEFT JOIN carriers c2 ON cs.tms_carrier_id = c2.id
-    """, conn)
-    conn.close()
-    return df
+        WHERE cs.id = 1
+    """)
+    return with_string_keys(df, CUSTOMER_SETTINGS_TEXT_COLUMNS)
 
 def save_customer_settings(customer_carrier_id, tms_carrier_id):
     conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute("DELETE FROM customer_settings")
-    cursor.execute("INSERT INTO customer_settings (customer_carrier_id, tms_carrier_id) VALUES (?, ?)",
-                 (customer_carrier_id, tms_carrier_id))
-    conn.commit()
-    conn.close()
+    with conn:
+        conn.execute(SQL_SAVE_CUSTOMER_SETTINGS, (customer_carrier_id, tms_carrier_id))
+        _bump_data_revision(conn)
 
 # ============ Shipping Rate Calculation ============
 
-def calculate_unit_shipping_rate(sku_code, distance_miles, carrier_id, vehicle_id=None):
+@functools.lru_cache(maxsize=1)
+def _shipping_reference(rev):
     """
-    计算单位运费 ($/unit)
-    基于SKU dimension、carrier rate和vehicle capacity
+    运费计算用的参考数据, 整表读入一次后按字典查找: (SKU尺寸, 承运商, 各承运商费率档位, 全部费率)
+    SKU 以 sku_code 为键, 值为 (length, width, height, weight); 承运商以 id 为键, 值为 (name, mode)
+    费率按插入顺序保存, 与逐条查询取第一条一致; 按参考数据版本号缓存, 任一进程修改 SKU/承运商/费率后失效
     """
     conn = get_connection()
+    skus = {row[0]: row[1:] for row in conn.execute(
+        "SELECT sku_code, length_in, width_in, height_in, weight_lbs FROM sku"
+    )}
+    carriers = {row[0]: row[1:] for row in conn.execute("SELECT id, name, mode FROM carriers")}
+    rates = tuple(conn.execute("""
+        SELECT r.id, r.carrier_id, r.min_distance, r.max_distance, r.rate_per_mile, r.minimum_charge, r.fixed_cost
+        FROM rates r
+        JOIN carriers c ON r.carrier_id = c.id
+        ORDER BY r.id
+    """))
+    tiers_by_carrier = {}
+    for _, carrier_id, *tier in rates:
+        tiers_by_carrier.setdefault(carrier_id, []).append(tuple(tier))
+    tiers_by_carrier = {carrier_id: tuple(tiers) for carrier_id, tiers in tiers_by_carrier.items()}
+    return skus, carriers, tiers_by_carrier, rates
+
+@functools.lru_cache(maxsize=4096)
+def _rate_lookup_inputs(rev, sku_code, carrier_id, vehicle_id):
+    """
+    calculate_unit_shipping_rate 中与距离无关的部分: (错误, 计费重量, 费率档位, 车辆容量)
+    按 (参考数据版本号, sku, carrier, vehicle) 缓存; SKU/承运商/费率/车辆的写操作会增加版本号
+    """
+    skus, carriers, tiers_by_carrier, _ = _shipping_reference(rev)
     
-    # 获取SKU信息
-    sku_df = pd.read_sql("SELECT * FROM sku WHERE sku_code = ?", conn, params=(sku_code,))
-    if sku_df.empty:
-        conn.close()
-        return 0, 0, "SKU not found"
-    
-    sku = sku_df.iloc[0]
-    actual_weight = sku['weight_lbs']
-    dim_weight = (sku['length_in'] * sku['width_in'] * sku['height_in']) / 139
+    # 获取SKU信息 (尺寸同时用于车辆容量)
+    sku_dims = skus.get(sku_code)
+    if sku_dims is None:
+        return "SKU not found", 0, (), 0
+    
+    length, width, height, actual_weight = sku_dims
+    dim_weight = (length * width * height) / 139
     chargeable_weight = max(actual_weight, dim_weight)
     
     # 获取carrier信息
-    carrier_df = pd.read_sql("SELECT * FROM carriers WHERE id = ?", conn, params=(carrier_id,))
-    if carrier_df.empty:
-        conn.close()
-        return 0, 0, "Carrier not found"
+    carrier = carriers.get(carrier_id)
+    if carrier is None:
+        return "Carrier not found", 0, (), 0
     
-    carrier_mode = carrier_df.iloc[0]['mode']
+    carrier_mode = carrier[1]
     
-    # 获取carrier的rate
-    rate_df = pd.read_sql("""
-        SELECT * FROM rates 
-        WHERE carrier_id = ? AND min_distance <= ? AND max_distance >= ?
-    """, conn, params=(carrier_id, distance_miles, distance_miles))
+    # carrier的全部费率档位 (按插入顺序)
+    tiers = tiers_by_carrier.get(carrier_id, ())
     
-    if rate_df.empty:
-        conn.close()
-        return 0, 0, "No rate found for this distance"
-    
-    rate = rate_df.iloc[0]
-    
-    # 计算车辆容量
-    # 车辆容量 - FTL和LTL都使用车辆容量
+    # 车辆容量 - FTL和LTL都使用车辆容量, 复用已取出的SKU尺寸
     max_units_per_vehicle = 1
     if carrier_mode in ['FTL', 'LTL']:
-        # 使用车辆容量
-        results, err = calculate_max_units_per_vehicle(sku_code, vehicle_id)
-        if err or not results:
-            max_units_per_vehicle = 1
-        else:
+        results = _vehicle_capacities(get_connection(), sku_dims, vehicle_id)
+        if results:
             # 使用最大的车辆容量
             max_units_per_vehicle = max([r['max_units'] for r in results])
     
+    return None, chargeable_weight, tiers, max_units_per_vehicle
+
+def calculate_unit_shipping_rate(sku_code, distance_miles, carrier_id, vehicle_id=None):
+    """
+    计算单位运费 ($/unit)
+    基于SKU dimension、carrier rate和vehicle capacity
+    """
+    err, chargeable_weight, tiers, max_units_per_vehicle = _rate_lookup_inputs(_reference_revision(), sku_code, carrier_id, vehicle_id)
+    if err:
+        return 0, 0, err
+    
+    # 获取carrier的rate
+    rate = next((t for t in tiers if t[0] <= distance_miles <= t[1]), None)
+    if rate is None:
+        return 0, 0, "No rate found for this distance"
+    
+    _, _, rate_per_mile, minimum_charge, fixed_cost = rate
+    
     # 计算总成本
-    variable_cost = chargeable_weight * rate['rate_per_mile'] * distance_miles / 100
-    total_cost = max(rate['minimum_charge'], variable_cost + rate['fixed_cost'])
+    variable_cost = chargeable_weight * rate_per_mile * distance_miles / 100
+    total_cost = max(minimum_charge, variable_cost + fixed_cost)
     
     # 单位成本 = 总成本 / 车辆容量
     cost_per_unit = total_cost / max_units_per_vehicle if max_units_per_vehicle > 0 else total_cost
     
-    conn.close()
-    
     return cost_per_unit, max_units_per_vehicle, None
 
+def calculate_unit_shipping_rate_matrix(sku_codes, distances, carrier_id, vehicle_id=None):
+    """
+    批量计算单位运费: calculate_unit_shipping_rate 的向量化版本
+    返回 (cost_per_unit, max_units)，形状均为 (len(distances), len(sku_codes))
+    查不到SKU/承运商/费率的格子与单条版本一致，返回 0, 0
+    SKU、承运商和费率档位与单条版本读同一份 _shipping_reference() 数据 (费率同样 JOIN carriers、按 id 排序)
+    """
+    distances = np.asarray(distances, dtype=np.float64)
+    shape = (len(distances), len(sku_codes))
+    cost_per_unit = np.zeros(shape)
+    max_units = np.zeros(shape, dtype=np.int64)
+    
+    ref_skus, carriers, tiers_by_carrier, _ = _shipping_reference(_reference_revision())
+    carrier = carriers.get(carrier_id)
+    if carrier is None or not len(sku_codes):
+        return cost_per_unit, max_units
+    
+    # 每个SKU的 (length, width, height, weight); 查不到的SKU为 NaN, 结果格子置 0
+    found = np.array([code in ref_skus for code in sku_codes])
+    dims = np.array([ref_skus.get(code, (np.nan,) * 4) for code in sku_codes], dtype=np.float64).reshape(-1, 4)
+    
+    # 计费重量 (每个SKU)
+    sku_volume = dims[:, 0] * dims[:, 1] * dims[:, 2]
+    actual_weight = dims[:, 3]
+    chargeable_weight = np.maximum(actual_weight, sku_volume / 139)
+    
+    # 车辆容量 (每个SKU，取最大的车辆)，与 calculate_max_units_per_vehicle 相同的 0.85 系数
+    # 车辆不在参考数据中, 与单条版本 (_vehicle_capacities) 一样按需查询
+    units_per_vehicle = np.ones(len(sku_codes), dtype=np.int64)
+    vehicles_df = pd.DataFrame()
+    if carrier[1] in ['FTL', 'LTL']:
+        conn = get_connection()
+        if vehicle_id:
+            vehicles_df = _frame(conn, "SELECT * FROM vehicles WHERE id = ?", (vehicle_id,))
+        else:
+            vehicles_df = _frame(conn, "SELECT * FROM vehicles")
+    if not vehicles_df.empty:
+        usable_volume = (vehicles_df['length_inches'] * vehicles_df['width_inches'] * vehicles_df['height_inches']).to_numpy() * 0.85
+        usable_weight = vehicles_df['max_weight_lbs'].to_numpy() * 0.85
+        with np.errstate(divide='ignore', invalid='ignore'):
+            by_volume = np.where(sku_volume[:, None] > 0, usable_volume[None, :] / sku_volume[:, None], 0)
+            by_weight = np.where(actual_weight[:, None] > 0, usable_weight[None, :] / actual_weight[:, None], 0)
+        units_per_vehicle = np.minimum(by_volume, by_weight).astype(np.int64).max(axis=1)
+    
+    # 每个距离取第一条匹配的费率档位 (min, max, rate_per_mile, minimum, fixed), 与单条版本的 next(...) 一致
+    tiers = tiers_by_carrier.get(carrier_id, ())
+    if not tiers:
+        return cost_per_unit, max_units
+    tiers = np.array(tiers, dtype=np.float64)
+    in_tier = (
+        (tiers[None, :, 0] <= distances[:, None]) &
+        (tiers[None, :, 1] >= distances[:, None])
+    )
+    has_rate = in_tier.any(axis=1)
+    tier = in_tier.argmax(axis=1)
+    rate_per_mile = tiers[tier, 2]
+    minimum_charge = tiers[tier, 3]
+    fixed_cost = tiers[tier, 4]
+    
+    # 计算总成本 (距离 x SKU)
+    variable_cost = chargeable_weight[None, :] * rate_per_mile[:, None] * distances[:, None] / 100
+    total_cost = np.maximum(minimum_charge[:, None], variable_cost + fixed_cost[:, None])
+    divisor = np.where(units_per_vehicle > 0, units_per_vehicle, 1)
+    
+    valid = has_rate[:, None] & found[None, :]
+    cost_per_unit = np.where(valid, total_cost / divisor[None, :], 0.0)
+    max_units = np.where(valid, units_per_vehicle[None, :], 0)
+    return cost_per_unit, max_units
+
+@_versioned_read
 def get_warehouses():
     conn = get_connection()
-    df = pd.read_sql("SELECT * FROM warehouses", conn)
-    conn.close()
-    # Convert column names to match app expectations (capitalize)
-    df = df.rename(columns={
-        'name': 'Name',
-        'address': 'Address',
-        'capacity': 'Capacity'
-    })
-    return df
+    # Column names match app expectations (capitalized via SQL aliases)
+    df = _frame(conn, """
+        SELECT id, name AS "Name", address AS "Address", capacity AS "Capacity", created_at
+        FROM warehouses
+    """)
+    return with_string_keys(df, WAREHOUSE_TEXT_COLUMNS)
 
 def add_warehouse(name, address, capacity):
     conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute("""
-        INSERT INTO warehouses (name, address, capacity) 
-        VALUES (?, ?, ?)
-    """, (name, address, capacity))
-    conn.commit()
-    conn.close()
+    with conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+            INSERT INTO warehouses (name, address, capacity) 
+            VALUES (?, ?, ?)
+        """, (name, address, capacity))
+        _bump_data_revision(conn)
 
 def save_warehouses_df(df):
     """Save warehouses DataFrame to database"""
+    rows = list(zip(df['Name'].tolist(), df['Address'].tolist(), df['Capacity'].astype(int).tolist()))
     conn = get_connection()
-    cursor = conn.cursor()
     
-    # Clear existing warehouses
-    cursor.execute("DELETE FROM warehouses")
-    
-    # Insert all rows
-    for _, row in df.iterrows():
-        cursor.execute("""
+    # DELETE + executemany in one transaction; committed on success, rolled back on error
+    with conn:
+        # Take the write lock up front instead of upgrading from a read lock
+        conn.execute("BEGIN IMMEDIATE")
+        _bump_data_revision(conn)
+        
+        # Clear existing warehouses
+        conn.execute("DELETE FROM warehouses")
+        
+        # Insert all rows in one executemany
+        conn.executemany("""
             INSERT INTO warehouses (name, address, capacity) 
             VALUES (?, ?, ?)
-        """, (
-            row['Name'], row['Address'], int(row['Capacity'])
-        ))
-    
-    conn.commit()
-    conn.close()
+        """, rows)
 
+@_versioned_read
 def get_distribution_centers():
     conn = get_connection()
-    df = pd.read_sql("SELECT * FROM distribution_centers", conn)
-    conn.close()
-    # Capitalize column names
-    df = df.rename(columns={
-        'channel': 'Channel',
-        'state': 'State',
-        'address': 'Address'
-    })
-    return df
+    # Capitalized column names via SQL aliases
+    df = _frame(conn, """
+        SELECT id, channel AS "Channel", state AS "State", address AS "Address"
+        FROM distribution_centers
+    """)
+    return with_string_keys(df)
 
 def add_dc(channel, state, address):
     conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute("INSERT INTO distribution_centers (channel, state, address) VALUES (?, ?, ?)", (channel, state, address))
-    conn.commit()
-    conn.close()
+    with conn:
+        cursor = conn.cursor()
+        cursor.execute("INSERT INTO distribution_centers (channel, state, address) VALUES (?, ?, ?)", (channel, state, address))
+        _bump_data_revision(conn)
 
+def bulk_save_dcs(df):
+    """用编辑后的DataFrame整体替换配送中心表 (一次事务, executemany)"""
+    conn = get_connection()
+    with conn:
+        conn.execute("BEGIN IMMEDIATE")
+        _bump_data_revision(conn)
+        conn.execute("DELETE FROM distribution_centers")
+        conn.executemany(
+            "INSERT INTO distribution_centers (channel, state, address) VALUES (?, ?, ?)",
+            _sql_rows(df[['Channel', 'State', 'Address']])
+        )
+
+@_versioned_read
 def get_demand_forecast():
     conn = get_connection()
-    df = pd.read_sql("SELECT * FROM demand_forecast", conn)
-    conn.close()
-    # Capitalize column names
-    df = df.rename(columns={
-        'product': 'Product',
-        'channel': 'Channel',
-        'state': 'State',
-        'demand_week3': 'Demand_Week3',
-        'demand_week4': 'Demand_Week4'
-    })
-    return df
+    # Capitalized column names via SQL aliases
+    df = _frame(conn, """
+        SELECT id, product AS "Product", channel AS "Channel", state AS "State",
+               demand_week3 AS "Demand_Week3", demand_week4 AS "Demand_Week4"
+        FROM demand_forecast
+    """)
+    # 需求为整数件数, int32 足够; 有空值时保持原类型
+    week_cols = ['Demand_Week3', 'Demand_Week4']
+    if df[week_cols].notna().all().all():
+        df = df.astype({col: 'int32' for col in week_cols})
+    return with_string_keys(df)
 
 def add_demand(product, channel, state, week3, week4):
     conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute("""
-        INSERT INTO demand_forecast (product, channel, state, demand_week3, demand_week4) 
-        VALUES (?, ?, ?, ?, ?)
-    """, (product, channel, state, week3, week4))
-    conn.commit()
-    conn.close()
+    with conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+            INSERT INTO demand_forecast (product, channel, state, demand_week3, demand_week4) 
+            VALUES (?, ?, ?, ?, ?)
+        """, (product, channel, state, week3, week4))
+        _bump_data_revision(conn)
 
+def bulk_save_demand(df):
+    """用编辑后的DataFrame整体替换需求预测表 (一次事务, executemany)"""
+    conn = get_connection()
+    with conn:
+        conn.execute("BEGIN IMMEDIATE")
+        _bump_data_revision(conn)
+        conn.execute("DELETE FROM demand_forecast")
+        conn.executemany("""
+            INSERT INTO demand_forecast (product, channel, state, demand_week3, demand_week4) 
+            VALUES (?, ?, ?, ?, ?)
+        """, _sql_rows(df[['Product', 'Channel', 'State', 'Demand_Week3', 'Demand_Week4']]))
+
+@_versioned_read
 def get_customer_allocation_plan():
     conn = get_connection()
-    df = pd.read_sql("SELECT * FROM customer_allocation_plan", conn)
-    conn.close()
-    # Capitalize column names
-    df = df.rename(columns={
-        'product': 'Product',
-        'warehouse': 'Warehouse',
-        'channel': 'Channel',
-        'state': 'State',
-        'allocated_units_week3': 'Allocated_Units_Week3',
-        'allocated_units_week4': 'Allocated_Units_Week4'
-    })
-    return df
+    # Capitalized column names via SQL aliases
+    df = _frame(conn, """
+        SELECT id, product AS "Product", warehouse AS "Warehouse", channel AS "Channel", state AS "State",
+               allocated_units_week3 AS "Allocated_Units_Week3", allocated_units_week4 AS "Allocated_Units_Week4"
+        FROM customer_allocation_plan
+    """)
+    return with_string_keys(df)
+
+# UPSERT 原地更新已有行; INSERT OR REPLACE 会先删除再插入
+SQL_SAVE_SETTING = """
+    INSERT INTO settings (key, value) VALUES (?, ?)
+    ON CONFLICT(key) DO UPDATE SET value = excluded.value
+"""
+SQL_GET_SETTING = "SELECT value FROM settings WHERE key = ?"
 
 def save_setting(key, value):
+    save_settings({key: value})
+
+def save_settings(values):
+    """一个事务内保存多个设置 ({key: value}), 只提交一次"""
     conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute("INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)", (key, value))
-    conn.commit()
-    conn.close()
+    with conn:
+        conn.executemany(SQL_SAVE_SETTING, values.items())
+        # load_all_data 按版本号缓存了设置值
+        _bump_data_revision(conn)
 
 def get_setting(key, default=None):
     conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT value FROM settings WHERE key = ?", (key,))
-    row = cursor.fetchone()
-    conn.close()
+    row = conn.execute(SQL_GET_SETTING, (key,)).fetchone()
     return row[0] if row else default
 
+def get_settings(defaults):
+    """一次查询读取多个设置; defaults 为 {key: 默认值}, 返回同样键的 dict"""
+    conn = get_connection()
+    keys = list(defaults)
+    placeholders = ", ".join("?" * len(keys))
+    values = dict(conn.execute(f"SELECT key, value FROM settings WHERE key IN ({placeholders})", keys).fetchall())
+    return {key: values.get(key, default) for key, default in defaults.items()}
+
 # ============ Shipping Cost Calculation ============
 
 def calculate_dim_weight(length, width, height, dim_factor=139):
@@ -829,91 +1176,131 @@ def calculate_shipping_cost(sku_code, distance_miles):
     """
     计算运费 - 基于SKU维度和配置的carrier费率
     返回: (carrier_name, mode, cost_per_unit, error_msg)
+    SKU 和费率来自 _shipping_reference() 的内存快照, 不再每次查询数据库
     """
-    conn = get_connection()
+    skus, carriers, _, rates = _shipping_reference(_reference_revision())
     
     # 获取SKU信息
-    sku_df = pd.read_sql("SELECT * FROM sku WHERE sku_code = ?", conn, params=(sku_code,))
-    if sku_df.empty:
-        conn.close()
+    sku_dims = skus.get(sku_code)
+    if sku_dims is None:
         return None, None, 0, f"SKU {sku_code} not found"
     
-    sku = sku_df.iloc[0]
-    actual_weight = sku['weight_lbs']
-    dim_weight = calculate_dim_weight(sku['length_in'], sku['width_in'], sku['height_in'])
+    length, width, height, actual_weight = sku_dims
+    dim_weight = calculate_dim_weight(length, width, height)
     chargeable_weight = max(actual_weight, dim_weight)
     
-    # 获取所有carrier的费率
-    rates_df = pd.read_sql("""
-        SELECT c.name, c.mode, r.rate_per_mile, r.minimum_charge, r.fixed_cost
-        FROM rates r
-        JOIN carriers c ON r.carrier_id = c.id
-        WHERE r.min_distance <= ? AND r.max_distance >= ?
-    """, conn, params=(distance_miles, distance_miles))
+    # 找到最便宜的carrier: 运费非正时按 0 比较, 同价取 id 最小
+    best_key, best = None, None
+    for rate_id, carrier_id, min_distance, max_distance, rate_per_mile, minimum_charge, fixed_cost in rates:
+        if min_distance <= distance_miles <= max_distance:
+            total_cost = max(minimum_charge, chargeable_weight * rate_per_mile * distance_miles / 100.0 + fixed_cost)
+            key = (total_cost if total_cost > 0 else 0, rate_id)
+            if best_key is None or key < best_key:
+                best_key, best = key, (carrier_id, total_cost)
     
-    conn.close()
-    
-    if rates_df.empty:
+    if best is None:
         # 使用默认费率
         return "Default", "LTL", 0.15, "No rate found, using default"
     
-    # 找到最便宜的carrier
-    best_rate = None
-    best_cost = float('inf')
-    
-    for _, rate in rates_df.iterrows():
-        variable_cost = chargeable_weight * rate['rate_per_mile'] * distance_miles / 100
-        total_cost = max(rate['minimum_charge'], variable_cost + rate['fixed_cost'])
-        cost_per_unit = total_cost / 1 if total_cost > 0 else 0  # 假设每单位
-        
-        if cost_per_unit < best_cost:
-            best_cost = cost_per_unit
-            best_rate = rate
-    
-    if best_rate is None:
-        return "Default", "LTL", 0.15, "No rate found, using default"
-    
-    return best_rate['name'], best_rate['mode'], best_cost, None
+    carrier_id, total_cost = best
+    name, mode = carriers[carrier_id]
+    cost_per_unit = total_cost if total_cost > 0 else 0  # 假设每单位
+    return name, mode, cost_per_unit, None
 
 # ============ Data Loading for App ============
 
+class LoadedData(NamedTuple):
+    """load_all_data 的结果, 按属性取各表"""
+    carriers: pd.DataFrame
+    rates: pd.DataFrame
+    sku: pd.DataFrame
+    warehouses: pd.DataFrame
+    distribution_centers: pd.DataFrame
+    demand_forecast: pd.DataFrame
+    customer_allocation_plan: pd.DataFrame
+    market_shipping_rate: float
+    tms_shipping_rate: float
+
+@st.cache_resource(max_entries=1, show_spinner=False)
+def _load_all_data_at_revision(rev):
+    """
+    按数据版本号缓存整份数据 (cache_resource: 各会话共用同一个 LoadedData, 命中时不做序列化)
+    任何写操作都会增加版本号, 旧结果随之失效; 返回的对象是共享的, 不能原地修改
+    """
+    # 所有表在同一个读事务内读取: 各表数据彼此一致, 不再每张表各开一次读事务
+    # 顺序读取而不用线程池: 快照属于本线程的连接, 各表查询都在毫秒以下, 且每个数据版本只读一次
+    # 调度计划、客户设置、库存和车辆只在各自用到的地方按需加载 (get_warehouse_schedule / get_customer_settings /
+    # get_warehouse_inventory / get_vehicles), 不随每次加载预取
+    with _read_snapshot():
+        # Load settings (one query for both rates)
+        settings = get_settings({'market_shipping_rate': '0.18', 'tms_shipping_rate': '0.12'})
+        
+        return LoadedData(
+            carriers=get_all_carriers(),
+            rates=get_rates_with_carrier(),
+            sku=get_all_sku(),
+            warehouses=get_warehouses(),
+            distribution_centers=get_distribution_centers(),
+            demand_forecast=get_demand_forecast(),
+            customer_allocation_plan=get_customer_allocation_plan(),
+            market_shipping_rate=float(settings['market_shipping_rate']),
+            tms_shipping_rate=float(settings['tms_shipping_rate']),
+        )
+
 def load_all_data():
-    """加载所有数据到session_state"""
-    data = {}
-    
-    data['carriers'] = get_all_carriers()
-    data['rates'] = get_rates_with_carrier()
-    data['sku'] = get_all_sku()
-    data['warehouses'] = get_warehouses()
-    data['distribution_centers'] = get_distribution_centers()
-    data['demand_forecast'] = get_demand_forecast()
-    data['customer_allocation_plan'] = get_customer_allocation_plan()
-    data['warehouse_inventory'] = get_warehouse_inventory()
-    data['warehouse_schedule'] = get_warehouse_schedule()
-    data['customer_settings'] = get_customer_settings()
-    data['vehicles'] = get_vehicles()
-    
-    # Load settings
-    data['market_shipping_rate'] = float(get_setting('market_shipping_rate', '0.18'))
-    data['tms_shipping_rate'] = float(get_setting('tms_shipping_rate', '0.12'))
-    
-    return data
-
-# 初始化数据库
-init_database()
-seed_default_data()
+    """
+    加载所有数据到session_state: 只查一次版本号, 每个 DataFrame 复制一份给调用方, 调用方无需再 copy
+    copy-on-write 下只做浅拷贝 (不复制数据), 否则深拷贝, 以免修改到共享的缓存结果
+    """
+    _bootstrap()
+    data = _load_all_data_at_revision(_data_revision())
+    deep = not PANDAS_COPY_ON_WRITE
+    return LoadedData(*(value.copy(deep=deep) if isinstance(value, pd.DataFrame) else value for value in data))
+
+# 初始化数据库: 每个进程第一次加载数据时执行一次, 不在 import 时执行
+@st.cache_resource(show_spinner=False)
+def _bootstrap():
+    init_database()
+    seed_default_data()
+    return True
 
 def reload_session_state():
-    """重新加载所有数据到session_state"""
+    """重新加载所有数据到session_state（启动初始化与数据变更后共用）"""
     data = load_all_data()
     
-    st.session_state.warehouses = data['warehouses'].copy()
-    st.session_state.distribution_centers = data['distribution_centers'].copy()
-    st.session_state.demand_forecast = data['demand_forecast'].copy()
-    st.session_state.customer_allocation_plan = data['customer_allocation_plan'].copy()
-    st.session_state.carriers = data['carriers'].copy()
-    st.session_state.rates = data['rates'].copy()
-    st.session_state.sku = data['sku'].copy()
-    st.session_state.warehouse_inventory = data['warehouse_inventory'].copy()
-    st.session_state.market_shipping_rate = data['market_shipping_rate']
-    st.session_state.tms_shipping_rate = data['tms_shipping_rate']
+    st.session_state.warehouses = data.warehouses
+    st.session_state.distribution_centers = data.distribution_centers
+    st.session_state.demand_forecast = data.demand_forecast
+    st.session_state.customer_allocation_plan = data.customer_allocation_plan
+    st.session_state.carriers = data.carriers.astype(SESSION_CATEGORY_COLUMNS['carriers'])
+    st.session_state.rates = data.rates.astype(SESSION_CATEGORY_COLUMNS['rates'])
+    st.session_state.sku = data.sku.astype(SESSION_CATEGORY_COLUMNS['sku'])
+    st.session_state.market_shipping_rate = data.market_shipping_rate
+    st.session_state.tms_shipping_rate = data.tms_shipping_rate
+
+# session_state 中低基数、仅用于展示/筛选的列存为 category
+SESSION_CATEGORY_COLUMNS = {
+    'carriers': {'mode': 'category'},
+    'rates': {'mode': 'category'},
+    'sku': {'unit_type': 'category'},
+}
+
+# 可单独刷新的 session_state 表 -> 读函数; 库存只用到各仓库+SKU的现有库存, 只取这三列
+SESSION_TABLE_LOADERS = {
+    'carriers': get_all_carriers,
+    'rates': get_rates_with_carrier,
+    'sku': get_all_sku,
+    'warehouse_inventory': functools.partial(get_warehouse_inventory, columns=('warehouse_name', 'sku_code', 'quantity_on_hand')),
+    'warehouse_schedule': get_warehouse_schedule,
+    'customer_settings': get_customer_settings,
+    'vehicles': get_vehicles,
+}
+
+def reload_table(name):
+    """
+    只刷新 session_state 中的一张表 (首次用到时, 或该表写操作之后), 其他表不重新读取
+    读函数本身有缓存, 未被写过的表不会重新查询
+    """
+    df = SESSION_TABLE_LOADERS[name]()
+    dtypes = SESSION_CATEGORY_COLUMNS.get(name)
+    st.session_state[name] = df.astype(dtypes) if dtypes else df